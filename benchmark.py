@@ -0,0 +1,174 @@
+#!/usr/bin/python
+import argparse
+import json
+import math
+import random
+import sys
+import time
+import simulator as sim
+
+# Complexity each op is expected to meet, in the number of employees n, and
+# the log-log growth slope tolerated for that class before it is flagged.
+EXPECTED = {
+    'Init': 'O(1)',
+    'AddJobSearcher': 'O(log n)',
+    'RemoveJobSearcher': 'O(log n)',
+    'Hire': 'O(log n)',
+    'HireBySalary': 'O(log n)',
+    'Bonus': 'O(log n)',
+    'Fire': 'O(log n)',
+    'GetNumEmployed': 'O(1)',
+    'HighestPaid': 'O(log n)',
+    'CutBacks': 'O(log n)',
+    'Quit': 'O(n)',
+}
+MAX_SLOPE = {
+    'O(1)': 0.3,
+    'O(log n)': 0.3,
+    'O(n)': 1.3,
+}
+
+
+def _timed(p, queries):
+    queries = list(queries)
+    start = time.time()
+    for _ in p.query_batch(queries):
+        pass
+    return (time.time() - start) / len(queries)
+
+
+def measure(n, firms, samples, rand):
+    """Seconds per command of each op, on a population of n employees.
+
+    Half of the employees are spread over the firms, the rest stay in the
+    recruitment pool. Ops drawing from the pool run at most once per job
+    searcher, so every timed command takes its Success path.
+    """
+    p = sim.Wet1Proxy(timeout=60)
+    try:
+        times = {}
+        # Wait for the exec to come up before timing anything.
+        p.Comment('benchmark n=%d' % n)
+        times['Init'] = _timed(p, ['Init %d' % firms])
+        employed = n // 2
+        for _ in p.query_batch('AddJobSearcher %d %d' % (i, rand.randint(
+                0, 10 * n)) for i in xrange(n)):
+            pass
+        for _ in p.query_batch('Hire %d %d' % (i % firms, i)
+                               for i in xrange(employed)):
+            pass
+        new_ids = range(n, n + samples)
+        pooled = range(employed, min(n, employed + samples))
+        hired = [rand.randrange(employed) for _ in xrange(samples)]
+        times['AddJobSearcher'] = _timed(p, (
+            'AddJobSearcher %d %d' % (i, rand.randint(0, 10 * n))
+            for i in new_ids))
+        times['RemoveJobSearcher'] = _timed(p, (
+            'RemoveJobSearcher %d' % i for i in new_ids))
+        times['Hire'] = _timed(p, ('Hire %d %d' % (i % firms, i)
+                                   for i in pooled))
+        times['Fire'] = _timed(p, ('Fire %d %d' % (i % firms, i)
+                                   for i in pooled))
+        times['Bonus'] = _timed(p, ('Bonus %d %d 1' % (i % firms, i)
+                                    for i in hired))
+        times['GetNumEmployed'] = _timed(p, (
+            'GetNumEmployed %d' % rand.randrange(firms)
+            for _ in xrange(samples)))
+        times['HighestPaid'] = _timed(p, (
+            'HighestPaid %d' % rand.randrange(firms)
+            for _ in xrange(samples)))
+        # Thresholds near the top of the salary range, so each CutBacks
+        # touches only a few employees and its search cost is what grows.
+        times['CutBacks'] = _timed(p, (
+            'CutBacks %d %d 1' % (rand.randrange(firms), 10 * n)
+            for _ in xrange(samples)))
+        times['HireBySalary'] = _timed(p, (
+            'HireBySalary %d %d' % (rand.randrange(firms), 10 * n)
+            for _ in pooled))
+        times['Quit'] = _timed(p, ['Quit'])
+        return times
+    finally:
+        p._proc.kill()
+        p._proc.wait()
+
+
+def slope(xs, ys):
+    """Least squares slope of log(ys) against log(xs)."""
+    lx = [math.log(x) for x in xs]
+    ly = [math.log(max(y, 1e-9)) for y in ys]
+    mx, my = sum(lx) / len(lx), sum(ly) / len(ly)
+    var = sum((x - mx) ** 2 for x in lx)
+    return sum((x - mx) * (y - my) for x, y in zip(lx, ly)) / var
+
+
+def run(sizes, firms, samples, repeat, seed, log=None):
+    rand = random.Random(seed)
+    runs = []
+    for n in sizes:
+        best = None
+        for _ in xrange(repeat):
+            times = measure(n, firms, samples, rand)
+            if best is None:
+                best = times
+            else:
+                best = dict((op, min(best[op], times[op])) for op in best)
+        runs.append(best)
+        if log:
+            log.write('n=%d %s\n' % (n, ' '.join(
+                '%s=%.2fus' % (op, best[op] * 1e6) for op in sorted(best))))
+    report = {'firms': firms, 'samples': samples, 'sizes': sizes, 'ops': {}}
+    for op in sorted(EXPECTED):
+        seconds = [times[op] for times in runs]
+        growth = slope(sizes, seconds) if len(sizes) > 1 else None
+        report['ops'][op] = {
+            'expected': EXPECTED[op],
+            'seconds_per_op': seconds,
+            'slope': growth,
+            'flagged': growth is not None and
+            growth > MAX_SLOPE[EXPECTED[op]],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time each wet1 op on growing populations and flag ops '
+                    'that grow faster than expected.')
+    parser.add_argument('--min', type=int, default=1000,
+                        help='smallest population (default: %(default)s)')
+    parser.add_argument('--max', type=int, default=1000000,
+                        help='largest population (default: %(default)s)')
+    parser.add_argument('--factor', type=int, default=10,
+                        help='population growth factor (default: '
+                             '%(default)s)')
+    parser.add_argument('-k', '--firms', type=int, default=10)
+    parser.add_argument('--samples', type=int, default=1000,
+                        help='commands timed per op and size')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per size, the fastest is kept')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='-')
+    args = parser.parse_args()
+
+    sizes = []
+    n = args.min
+    while n <= args.max:
+        sizes.append(n)
+        n *= args.factor
+    report = run(sizes, args.firms, args.samples, args.repeat, args.seed,
+                 log=sys.stderr)
+    text = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    if args.output == '-':
+        sys.stdout.write(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    for op, result in sorted(report['ops'].items()):
+        if result['flagged']:
+            sys.stderr.write('%s grows faster than %s (slope %.2f)\n' % (
+                op, result['expected'], result['slope']))
+    return 1 if any(r['flagged'] for r in report['ops'].values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/python
+import argparse
+import array
+import itertools
+import mmap
+import struct
+import sys
+import simulator as sim
+
+# File layout: a header, then fixed-width little-endian int32 records of
+# (opcode, arg0, arg1, arg2), followed by (status, value) of the expected
+# output if the header has FLAG_EXPECTED. Unused args are 0. Comments have
+# no opcode and are dropped.
+MAGIC = 'WET1BIN\0'
+VERSION = 1
+FLAG_EXPECTED = 1
+HEADER = struct.Struct('<8sII')
+
+OPCODES = ('Init', 'AddJobSearcher', 'RemoveJobSearcher', 'Hire',
+           'HireBySalary', 'Bonus', 'Fire', 'GetNumEmployed', 'HighestPaid',
+           'CutBacks', 'Quit')
+OPCODE_OF = dict((name, op) for op, name in enumerate(OPCODES))
+ARITY = tuple(sim.COMMAND_FORMATS[name].count('%d') for name in OPCODES)
+
+STATUSES = ('done', 'Success', 'Failure', 'Invalid_input', 'already')
+STATUS_OF = dict((status, i) for i, status in enumerate(STATUSES))
+VALUED = ('GetNumEmployed', 'HighestPaid')
+
+CHUNK = 1 << 16
+
+
+def encode_output(name, line):
+    """'HighestPaid: Success 3' -> (status, value)."""
+    line = line.strip()
+    if line == name + ' done.':
+        return STATUS_OF['done'], 0
+    if line == name + ' was already called.':
+        return STATUS_OF['already'], 0
+    prefix, _, result = line.partition(': ')
+    parts = result.split()
+    if prefix != name or not parts or parts[0] not in STATUS_OF:
+        raise ValueError('Cannot encode output "%s" of %s' % (line, name))
+    return STATUS_OF[parts[0]], int(parts[1]) if len(parts) > 1 else 0
+
+
+def decode_output(name, status, value):
+    """Inverse of encode_output, without the trailing newline."""
+    status = STATUSES[status]
+    if status == 'done':
+        return name + ' done.'
+    if status == 'already':
+        return name + ' was already called.'
+    if status == 'Success' and name in VALUED:
+        return '%s: Success %d' % (name, value)
+    return '%s: %s' % (name, status)
+
+
+def write_binary(commands, path, expected=False):
+    """Write (name, args) commands as a binary trace, simulating them for the
+    expected column if asked. Returns the number of records."""
+    s = sim.Wet1Sim() if expected else None
+    width = 6 if expected else 4
+    count = 0
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, FLAG_EXPECTED if expected else 0))
+        records = array.array('i')
+        for name, args in commands:
+            if name == 'Comment':
+                continue
+            records.append(OPCODE_OF[name])
+            records.extend(args)
+            records.extend([0] * (3 - len(args)))
+            if s:
+                records.extend(encode_output(name, getattr(s, name)(*args)))
+            count += 1
+            if len(records) >= CHUNK * width:
+                _write_records(f, records)
+                records = array.array('i')
+        _write_records(f, records)
+    return count
+
+
+def _write_records(f, records):
+    if sys.byteorder == 'big':
+        records.byteswap()
+    f.write(records.tostring())
+
+
+class BinaryTrace(object):
+    """Memory-mapped binary trace."""
+
+    def __init__(self, path):
+        self._f = open(path, 'rb')
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a binary trace' % path)
+        self.has_expected = bool(flags & FLAG_EXPECTED)
+        self.width = 6 if self.has_expected else 4
+        self._record_size = self.width * 4
+        self._count = (len(self._mm) - HEADER.size) // self._record_size
+
+    def __len__(self):
+        return self._count
+
+    def chunks(self, start=0):
+        """Yield flat int arrays of up to CHUNK records each."""
+        for first in xrange(start, self._count, CHUNK):
+            end = min(first + CHUNK, self._count)
+            size = self._record_size
+            records = array.array('i')
+            records.fromstring(self._mm[HEADER.size + first * size:
+                                        HEADER.size + end * size])
+            if sys.byteorder == 'big':
+                records.byteswap()
+            yield records
+
+    def records(self, start=0):
+        """Yield (opcode, arg0, arg1, arg2[, status, value]) tuples."""
+        width = self.width
+        for records in self.chunks(start):
+            for i in xrange(0, len(records), width):
+                yield tuple(records[i:i + width])
+
+    def commands(self):
+        """Yield (name, args) commands, as read_commands does."""
+        for r in self.records():
+            yield OPCODES[r[0]], r[1:1 + ARITY[r[0]]]
+
+    def expected(self):
+        """Yield the expected output lines, without newlines."""
+        if not self.has_expected:
+            raise ValueError('trace has no expected column')
+        for r in self.records():
+            yield decode_output(OPCODES[r[0]], r[4], r[5])
+
+    def close(self):
+        self._mm.close()
+        self._f.close()
+
+
+def simulate(trace, s=None):
+    """Run a trace on a Wet1Sim through an opcode table; yields outputs."""
+    s = s or sim.Wet1Sim()
+    table = [(getattr(s, name), ARITY[op]) for op, name in enumerate(OPCODES)]
+    for r in trace.records():
+        f, n = table[r[0]]
+        yield f(*r[1:1 + n]).strip()
+
+
+def queries(trace):
+    templates = [(sim.COMMAND_FORMATS[name], ARITY[op])
+                 for op, name in enumerate(OPCODES)]
+    for r in trace.records():
+        template, n = templates[r[0]]
+        yield template % r[1:1 + n]
+
+
+def replay(trace, window=256, **kwargs):
+    """Run a trace on the exec, comparing against the expected column or
+    against the simulator if the trace has none.
+
+    Returns (index, name, expected, actual) of the first mismatch, or None.
+    """
+    expected = trace.expected() if trace.has_expected else simulate(trace)
+    p = sim.Wet1Proxy(**kwargs)
+    try:
+        actual = p.query_batch(queries(trace), window)
+        for i, (r, e, a) in enumerate(itertools.izip(trace.records(), expected,
+                                                     actual)):
+            a = a.strip()
+            if e != a:
+                return i, OPCODES[r[0]], e, a
+    finally:
+        p._proc.kill()
+        p._proc.wait()
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert command files to and from the binary trace '
+                    'format, and replay binary traces.')
+    sub = parser.add_subparsers(dest='mode')
+    to_binary = sub.add_parser('to-binary', help='text commands to binary')
+    to_binary.add_argument('commands')
+    to_binary.add_argument('-o', '--output', required=True)
+    to_binary.add_argument('--expected', action='store_true',
+                           help='store the simulated output of every command')
+    to_text = sub.add_parser('to-text', help='binary to text commands')
+    to_text.add_argument('trace')
+    to_text.add_argument('-o', '--output', help='default: stdout')
+    replay_ = sub.add_parser('replay', help='replay on the exec')
+    replay_.add_argument('trace')
+    replay_.add_argument('--sim-only', action='store_true',
+                         help='only run the simulator, printing its output')
+    args = parser.parse_args()
+
+    if args.mode == 'to-binary':
+        count = write_binary(sim.read_commands(args.commands), args.output,
+                             args.expected)
+        sys.stdout.write('%d records -> %s\n' % (count, args.output))
+        return 0
+    trace = BinaryTrace(args.trace)
+    try:
+        if args.mode == 'to-text':
+            out = open(args.output, 'w') if args.output else sys.stdout
+            for name, args_ in trace.commands():
+                out.write(sim.format_command(name, *args_) + '\n')
+            if out is not sys.stdout:
+                out.close()
+            return 0
+        if args.sim_only:
+            for line in simulate(trace):
+                sys.stdout.write(line + '\n')
+            return 0
+        mismatch = replay(trace)
+    finally:
+        trace.close()
+    if mismatch:
+        index, name, expected, actual = mismatch
+        sys.stdout.write('record %d, %s: "%s" != "%s"\n' % (index, name,
+                                                           actual, expected))
+        return 1
+    sys.stdout.write('ok (%d records)\n' % len(trace))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+#!/usr/bin/python
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+import minimizer
+import simulator as sim
+import trace_generator
+
+DEFAULT_DIR = os.path.join(os.getcwd(), 'test-output', 'campaign')
+
+
+def fuzz_trace(seed, length, firms):
+    gen = trace_generator.TraceGenerator(seed, firms, (0, firms), (0, firms),
+                                         invalid=0.1)
+    return gen.generate([(length, trace_generator.PHASES['mix'])])
+
+
+def run_seed(job):
+    """Fuzz a single seed in a worker; returns (seed, divergence)."""
+    seed, length, firms = job
+    return seed, minimizer.first_divergence(fuzz_trace(seed, length, firms))
+
+
+def _payload_free(line):
+    """'HighestPaid: Success 3' -> 'HighestPaid: Success'."""
+    head, _, tail = line.rpartition(' ')
+    if head.endswith(': Success') and tail.lstrip('-').isdigit():
+        return head
+    return line
+
+
+def signature(name, expected, actual):
+    """What tells divergences apart: the op and its expected and actual
+    output, with Success payloads dropped."""
+    return name, _payload_free(expected), _payload_free(actual)
+
+
+def parse_duration(text):
+    """'90', '30m', '12h' -> seconds."""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if text[-1:] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+class Campaign(object):
+    """Seeds done so far and the unique divergences they found, saved to
+    state.json in the campaign directory after every seed."""
+
+    def __init__(self, path, length, firms, shard=0, shards=1):
+        self.path = path
+        self._state = os.path.join(path, 'state.json')
+        if os.path.exists(self._state):
+            with open(self._state) as f:
+                state = json.load(f)
+            if (state['length'], state['firms'], state['shard']) != \
+                    (length, firms, [shard, shards]):
+                raise ValueError('%s was run with --length %d -k %d '
+                                 '--shard %d/%d' % ((path, state['length'],
+                                                     state['firms']) +
+                                                    tuple(state['shard'])))
+        else:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            state = {'length': length, 'firms': firms,
+                     'shard': [shard, shards], 'next_seed': shard,
+                     'done': [], 'seeds_run': 0, 'seconds': 0.0,
+                     'signatures': []}
+        self.length = length
+        self.firms = firms
+        self.shard = shard
+        self.shards = shards
+        # Every seed of the shard below next_seed is done, as are those in
+        # done.
+        self.next_seed = state['next_seed']
+        self.done = set(state['done'])
+        self.seeds_run = state['seeds_run']
+        self.seconds = state['seconds']
+        self.signatures = state['signatures']
+
+    def pending(self):
+        """Seeds of the shard not done yet, in order."""
+        for seed in itertools.count(self.next_seed, self.shards):
+            if seed not in self.done:
+                yield seed
+
+    def add(self, seed, divergence):
+        self.seeds_run += 1
+        self.done.add(seed)
+        while self.next_seed in self.done:
+            self.done.remove(self.next_seed)
+            self.next_seed += self.shards
+        if divergence is None:
+            return None
+        index, name, expected, actual = divergence
+        key = signature(name, expected, actual)
+        for s in self.signatures:
+            if signature(s['command'], s['expected'], s['actual']) == key:
+                s['count'] += 1
+                if index < s['index']:
+                    s['seed'], s['index'] = seed, index
+                    self._write_reproducer(s)
+                return None
+        s = {'command': name, 'expected': expected, 'actual': actual,
+             'count': 1, 'seed': seed, 'index': index,
+             'reproducer': 'repro-%02d' % len(self.signatures)}
+        self.signatures.append(s)
+        self._write_reproducer(s)
+        return s
+
+    def _write_reproducer(self, s):
+        """Commands of the seed up to and including its divergence; the
+        shortest one seen is kept for each signature."""
+        commands = itertools.islice(fuzz_trace(s['seed'], self.length,
+                                               self.firms), s['index'] + 1)
+        with open(os.path.join(self.path, s['reproducer']), 'w') as f:
+            trace_generator.write_trace(commands, f)
+
+    def save(self, seconds):
+        state = {'length': self.length, 'firms': self.firms,
+                 'shard': [self.shard, self.shards],
+                 'next_seed': self.next_seed, 'done': sorted(self.done),
+                 'seeds_run': self.seeds_run,
+                 'seconds': self.seconds + seconds,
+                 'signatures': self.signatures}
+        tmp = self._state + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.rename(tmp, self._state)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fuzz the exec with consecutive seeds over a pool of '
+                    'processes until a time budget runs out, keeping one '
+                    'reproducer per distinct divergence. Rerunning with the '
+                    'same directory resumes the campaign.')
+    parser.add_argument('-d', '--dir', default=DEFAULT_DIR,
+                        help='campaign directory (default: %(default)s)')
+    parser.add_argument('-b', '--budget', type=parse_duration, default='1h',
+                        help='wall-clock budget, e.g. 600, 30m, 12h '
+                             '(default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--shard', default='0/1', metavar='I/N',
+                        help='only run seeds equal to I modulo N, to split a '
+                             'campaign over machines')
+    parser.add_argument('--length', type=int, default=5 ** 7,
+                        help='commands per seed')
+    parser.add_argument('-k', '--firms', type=int, default=5)
+    args = parser.parse_args()
+    shard, shards = map(int, args.shard.split('/'))
+
+    campaign = Campaign(args.dir, args.length, args.firms, shard, shards)
+    seeds = campaign.pending()
+    pool = multiprocessing.Pool(args.jobs)
+    start = time.time()
+    in_flight = []
+    try:
+        while True:
+            while time.time() - start < args.budget and \
+                    len(in_flight) < 2 * args.jobs:
+                job = (next(seeds), args.length, args.firms)
+                in_flight.append(pool.apply_async(run_seed, (job,)))
+            if not in_flight:
+                break
+            in_flight[0].wait(max(0.1, args.budget - (time.time() - start)))
+            if not in_flight[0].ready():
+                break
+            seed, divergence = in_flight.pop(0).get()
+            new = campaign.add(seed, divergence)
+            campaign.save(time.time() - start)
+            if new:
+                sys.stdout.write('\nseed %d: %s: "%s" != "%s" -> %s\n' % (
+                    seed, new['command'], new['actual'], new['expected'],
+                    new['reproducer']))
+            else:
+                sys.stdout.write('F' if divergence else '.')
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Seeds still running are not recorded and run again on resume.
+        pool.terminate()
+        pool.join()
+
+    sys.stdout.write('\n%d seeds run, %d distinct divergences (%s)\n' % (
+        campaign.seeds_run, len(campaign.signatures), args.dir))
+    for s in campaign.signatures:
+        sys.stdout.write('  %s x%d: %s: "%s" != "%s"\n' % (
+            s['reproducer'], s['count'], s['command'], s['actual'],
+            s['expected']))
+    return 1 if campaign.signatures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/python
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import select
+import sys
+import traceback
+import simulator as sim
+from multiplexer import Multiplexer
+
+
+class Checkpoint(object):
+    """A setup prefix simulated once and shared by many suffixes.
+
+    Every suffix runs in a child forked after the prefix, which gets a
+    copy-on-write snapshot of the simulator for free and reports its result
+    back over a pipe. The exec is a separate program that cannot be forked
+    from the outside, so each exec still reads the prefix; it is checked
+    against the outputs recorded here, without simulating the prefix again.
+    """
+
+    def __init__(self, commands):
+        self.commands = list(commands)
+        self._sim = sim.Wet1Sim()
+        self.expected = [getattr(self._sim, name)(*args).strip()
+                         for name, args in self.commands]
+
+    def _run_suffix(self, key, suffix, window, kwargs):
+        """Run in a forked child: this process' simulator is its own."""
+        m = Multiplexer(window)
+        m.add(key, itertools.chain(self.commands, suffix),
+              simulator=self._sim, expected=self.expected, **kwargs)
+        return m.run()[key]
+
+    def _fork(self, key, suffix, window, kwargs):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid:
+            os.close(w)
+            return pid, r
+        os.close(r)
+        code = 0
+        try:
+            result = self._run_suffix(key, suffix, window, kwargs)
+        except Exception:
+            result = (-1, 'error', '', traceback.format_exc())
+            code = 1
+        finally:
+            os.write(w, json.dumps(result))
+            os._exit(code)
+
+    def run_suffixes(self, suffixes, jobs=None, window=64, **kwargs):
+        """Run every suffix after the prefix, up to jobs at a time.
+
+        suffixes maps keys to iterables of (name, args). Returns
+        {key: None or (index, name, expected, actual)}, indices counting
+        from the start of the prefix.
+        """
+        jobs = jobs or multiprocessing.cpu_count()
+        todo = list(suffixes.items())
+        running = {}
+        results = {}
+        while todo or running:
+            while todo and len(running) < jobs:
+                key, suffix = todo.pop()
+                pid, fd = self._fork(key, suffix, window, kwargs)
+                running[fd] = key, pid, []
+            readable, _, _ = select.select(list(running), [], [])
+            for fd in readable:
+                key, pid, chunks = running[fd]
+                data = os.read(fd, 65536)
+                if data:
+                    chunks.append(data)
+                    continue
+                os.close(fd)
+                os.waitpid(pid, 0)
+                del running[fd]
+                result = json.loads(''.join(chunks)) if chunks else \
+                    (-1, 'error', '', 'checkpoint child died')
+                results[key] = tuple(result) if result else None
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run several command files after a shared setup prefix, '
+                    'simulating the prefix only once.')
+    parser.add_argument('prefix', help='command file with the shared prefix')
+    parser.add_argument('suffixes', nargs='+', help='command files to run '
+                                                    'after the prefix')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint(sim.read_commands(args.prefix))
+    results = checkpoint.run_suffixes(
+        dict((path, sim.read_commands(path)) for path in args.suffixes),
+        args.jobs)
+    failed = 0
+    for key, result in sorted(results.items()):
+        if result:
+            failed += 1
+            index, name, expected, actual = result
+            sys.stdout.write('%s ... FAIL at command %d, %s: "%s" != "%s"\n'
+                             % (key, index, name, actual, expected))
+        else:
+            sys.stdout.write('%s ... ok\n' % key)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
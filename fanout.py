@@ -0,0 +1,148 @@
+#!/usr/bin/python
+import argparse
+import itertools
+import json
+import select
+import sys
+import time
+import simulator as sim
+import trace_generator
+
+
+class FanOut(object):
+    """Checks many execs against a single simulator run.
+
+    Commands go out window at a time to every exec still passing; the
+    simulator runs each command once and all execs are compared against
+    that shared expected output.
+    """
+
+    def __init__(self, exec_paths, window=256, timeout=10, **kwargs):
+        self.window = window
+        self.timeout = timeout
+        self.results = {}
+        self._proxies = {}
+        self._matchers = {}
+        for path in exec_paths:
+            self._proxies[path] = sim.Wet1Proxy(exec_path=path, **kwargs)
+            self._matchers[path] = sim.ReplyMatcher()
+
+    def _finish(self, path, result):
+        self.results[path] = result
+        del self._matchers[path]
+        p = self._proxies.pop(path)
+        p._proc.kill()
+        p._proc.wait()
+
+    def _collect(self):
+        """Read the outputs of the last window from every exec; returns
+        {path: outputs}, settled with a marker for execs that died or timed
+        out."""
+        outputs = dict((path, []) for path in self._proxies)
+        by_fd = dict((p.fileno(), path) for path, p in self._proxies.items())
+        poller = select.poll()
+        for fd in by_fd:
+            poller.register(fd, select.POLLIN)
+        deadline = time.time() + self.timeout
+        while by_fd:
+            ready = poller.poll(max(0, deadline - time.time()) * 1000)
+            if not ready:
+                marker = sim.TIMED_OUT
+                break
+            for fd, _ in ready:
+                path = by_fd[fd]
+                matcher = self._matchers[path]
+                lines, alive = self._proxies[path].receive()
+                for line in lines:
+                    outputs[path].extend(matcher.feed(line))
+                # The window's trailing sync comment has been echoed, or
+                # output follows it.
+                if not len(matcher) or not alive:
+                    poller.unregister(fd)
+                    del by_fd[fd]
+            deadline = time.time() + self.timeout
+        else:
+            marker = sim.PROCESS_DIED
+        for path, lines in outputs.items():
+            matcher = self._matchers[path]
+            while len(matcher):
+                lines.extend(matcher.feed(marker))
+            extra = matcher.unexpected
+            if extra:
+                lines.append(extra[0])
+        return outputs
+
+    def run(self, commands, s=None):
+        """Run (name, args) commands until they or the passing execs run out.
+
+        Returns {exec path: None or (index, name, expected, actual)} where
+        the tuple is the first divergence of that exec. Output after the
+        reply to the last command of a window is reported against that
+        command.
+        """
+        s = s or sim.Wet1Sim()
+        commands = iter(commands)
+        for start in itertools.count(0, self.window):
+            chunk = list(itertools.islice(commands, self.window))
+            if not chunk or not self._proxies:
+                break
+            queries = [sim.format_command(name, *args) for name, args in chunk]
+            for path, p in self._proxies.items():
+                p.send(self._matchers[path].add(queries))
+            expected = [getattr(s, name)(*args).strip()
+                        for name, args in chunk]
+            expected.append(sim.NO_OUTPUT.strip())
+            for path, lines in self._collect().items():
+                for i, (e, a) in enumerate(zip(expected, lines)):
+                    a = a.strip()
+                    if e != a:
+                        i = min(i, len(chunk) - 1)
+                        self._finish(path, (start + i, chunk[i][0], e, a))
+                        break
+        for path in list(self._proxies):
+            self._finish(path, None)
+        return self.results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check many execs (build variants, submissions) against '
+                    'a single simulator run.')
+    parser.add_argument('execs', nargs='+', help='exec files')
+    parser.add_argument('-c', '--commands', help='command file (default: a '
+                                                 'generated fuzz trace)')
+    parser.add_argument('--length', type=int, default=100000,
+                        help='commands of the fuzz trace')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-k', '--firms', type=int, default=5)
+    parser.add_argument('--window', type=int, default=256)
+    parser.add_argument('-o', '--output', help='JSON report')
+    args = parser.parse_args()
+
+    if args.commands:
+        commands = sim.read_commands(args.commands)
+    else:
+        gen = trace_generator.TraceGenerator(args.seed, args.firms, (0, 5),
+                                             (0, 5), invalid=0.1)
+        commands = gen.generate([(args.length, trace_generator.PHASES['mix'])])
+    results = FanOut(args.execs, args.window).run(commands)
+    report = {}
+    for path in args.execs:
+        result = results[path]
+        if result:
+            index, name, expected, actual = result
+            sys.stdout.write('%s ... FAIL at command %d, %s: "%s" != "%s"\n'
+                             % (path, index, name, actual, expected))
+            report[path] = {'passed': False, 'index': index, 'command': name,
+                            'expected': expected, 'actual': actual}
+        else:
+            sys.stdout.write('%s ... ok\n' % path)
+            report[path] = {'passed': True}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 1 if any(results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
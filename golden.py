@@ -0,0 +1,107 @@
+#!/usr/bin/python
+import argparse
+import difflib
+import hashlib
+import os
+import sys
+import simulator as sim
+
+DEFAULT_CACHE = os.path.join(os.getcwd(), 'test-output', 'golden')
+
+
+def source_digest(module):
+    with open(os.path.splitext(module.__file__)[0] + '.py', 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+# Part of every key, so outputs recorded by another version of the
+# simulator are not replayed as expected ones.
+SIMULATOR_DIGEST = source_digest(sim)
+
+
+def trace_key(command_path):
+    """Hash of the simulator and the commands, the same for a log and its
+    compressed copy."""
+    h = hashlib.sha1(SIMULATOR_DIGEST)
+    for line in sim.read_log(command_path):
+        h.update(line)
+    return h.hexdigest()
+
+
+def simulate(commands):
+    s = sim.Wet1Sim()
+    for name, args in commands:
+        yield getattr(s, name)(*args).strip()
+
+
+def record(command_path, cache=DEFAULT_CACHE):
+    """Simulate a command file once and cache its expected output."""
+    path = os.path.join(cache, trace_key(command_path))
+    if not os.path.exists(path):
+        if not os.path.isdir(cache):
+            os.makedirs(cache)
+        tmp = '%s.%d' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            for line in simulate(sim.read_commands(command_path)):
+                f.write(line + '\n')
+        os.rename(tmp, path)
+    return path
+
+
+def replay(command_path, cache=DEFAULT_CACHE, proxy_output=None, **kwargs):
+    """Run a command file on the exec and diff it against the cached output.
+
+    Returns the diff lines, empty if the outputs match.
+    """
+    with open(record(command_path, cache)) as f:
+        expected = [line.rstrip('\n') for line in f]
+    p = sim.Wet1Proxy(**kwargs)
+    try:
+        queries = (sim.format_command(name, *args)
+                   for name, args in sim.read_commands(command_path))
+        actual = [line.strip() for line in p.query_batch(queries)]
+    finally:
+        p._proc.kill()
+        p._proc.wait()
+    if proxy_output:
+        with open(proxy_output, 'w') as f:
+            f.writelines(line + '\n' for line in actual)
+    return list(difflib.unified_diff(expected, actual, 'expected', 'actual',
+                                     lineterm=''))
+
+
+def actual_output_path(command_path):
+    head, tail = os.path.split(command_path)
+    if '-commands-' in tail:
+        return os.path.join(head,
+                            tail.replace('-commands-', '-replay-actual-'))
+    return command_path + '.replay-actual'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Record expected outputs of command files, or replay '
+                    'them on the exec without simulating.')
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('commands', nargs='+', help='command files')
+    parser.add_argument('--cache', default=DEFAULT_CACHE,
+                        help='expected output cache (default: %(default)s)')
+    args = parser.parse_args()
+
+    failed = 0
+    for command_path in args.commands:
+        if args.mode == 'record':
+            sys.stdout.write('%s -> %s\n' % (command_path,
+                                             record(command_path, args.cache)))
+            continue
+        diff = replay(command_path, args.cache,
+                      proxy_output=actual_output_path(command_path))
+        sys.stdout.write('%s ... %s\n' % (command_path,
+                                          'FAIL' if diff else 'ok'))
+        if diff:
+            failed += 1
+            sys.stdout.write('\n'.join(diff[:40]) + '\n')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+import argparse
+import sys
+
+
+def read_memory_log(path):
+    """(command, employees, firms, rss_kb, hwm_kb) rows of a memory log."""
+    rows = []
+    with open(path) as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                rows.append(tuple(int(x) for x in line.split()))
+    return rows
+
+
+def fit(xs, ys):
+    """Least squares (intercept, slope) of ys against xs."""
+    n = float(len(xs))
+    mx, my = sum(xs) / n, sum(ys) / n
+    var = sum((x - mx) ** 2 for x in xs)
+    if not var:
+        return my, 0.0
+    slope = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / var
+    return my - slope * mx, slope
+
+
+def summarize(rows):
+    employees = [r[1] for r in rows]
+    rss = [r[3] * 1024 for r in rows]
+    base, per_employee = fit(employees, rss)
+    return {
+        'samples': len(rows),
+        'max_employees': max(employees),
+        'firms': max(r[2] for r in rows),
+        'peak_rss_kb': max(r[3] for r in rows),
+        'peak_hwm_kb': max(r[4] for r in rows),
+        'base_bytes': base,
+        'bytes_per_employee': per_employee,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Relate exec memory to the live employee count, from the '
+                    'Wet1TestCases-memory-NUM logs.')
+    parser.add_argument('logs', nargs='+')
+    parser.add_argument('--max-bytes-per-employee', type=float, default=1024,
+                        help='flag logs above this growth (default: '
+                             '%(default)s)')
+    parser.add_argument('--min-employees', type=int, default=1000,
+                        help='only flag logs reaching this many employees, '
+                             'smaller ones are dominated by page granularity '
+                             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    flagged = 0
+    for path in args.logs:
+        rows = read_memory_log(path)
+        if not rows:
+            continue
+        s = summarize(rows)
+        bad = (s['max_employees'] >= args.min_employees and
+               s['bytes_per_employee'] > args.max_bytes_per_employee)
+        flagged += bad
+        sys.stdout.write(
+            '%s: %d samples, up to %d employees in %d firms, peak RSS %d kB, '
+            'peak HWM %d kB, %.0f bytes + %.1f bytes/employee%s\n' % (
+                path, s['samples'], s['max_employees'], s['firms'],
+                s['peak_rss_kb'], s['peak_hwm_kb'], s['base_bytes'],
+                s['bytes_per_employee'], ' FLAGGED' if bad else ''))
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/python
+import argparse
+import itertools
+import multiprocessing
+import sys
+import simulator as sim
+
+
+def first_divergence(commands, window=256, **kwargs):
+    """Run commands on a fresh exec and simulator, stopping at the first
+    mismatch.
+
+    Returns (index, name, expected, actual) of that mismatch, or None if the
+    outputs agree or the simulator rejects the trace (e.g. a command before
+    Init).
+    """
+    s = sim.Wet1Sim()
+    p = sim.Wet1Proxy(**kwargs)
+    try:
+        commands = iter(commands)
+        for start in itertools.count(0, window):
+            chunk = list(itertools.islice(commands, window))
+            if not chunk:
+                return None
+            try:
+                expected = [getattr(s, name)(*args).strip()
+                            for name, args in chunk]
+            except Exception:
+                return None
+            actual = p.query_batch(
+                [sim.format_command(name, *args) for name, args in chunk],
+                window)
+            for i, (e, a) in enumerate(zip(expected, actual)):
+                a = a.strip()
+                if e != a:
+                    return start + i, chunk[i][0], e, a
+    finally:
+        p._proc.kill()
+        p._proc.wait()
+
+
+def _check(job):
+    commands, op = job
+    divergence = first_divergence(commands)
+    if divergence and (op is None or divergence[1] == op):
+        return divergence
+
+
+def _split(items, n):
+    size, extra = divmod(len(items), n)
+    chunks, start = [], 0
+    for i in xrange(n):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def minimize(commands, pool, same_op=True, log=None):
+    """Delta-debug commands down to a trace that still diverges.
+
+    With same_op, candidates only count if they diverge on the same op as
+    the original trace. Every failing candidate is cut right after its
+    divergence, since nothing later can matter.
+    """
+    commands = list(commands)
+    divergence = _check((commands, None))
+    if divergence is None:
+        raise ValueError('Trace does not diverge')
+    op = divergence[1] if same_op else None
+    commands = commands[:divergence[0] + 1]
+    n = 2
+    while len(commands) >= 2:
+        chunks = _split(commands, n)
+        candidates = list(chunks)
+        if n > 2:
+            candidates += [list(itertools.chain(*(chunks[:i] +
+                                                  chunks[i + 1:])))
+                           for i in xrange(n)]
+        results = pool.map(_check, [(c, op) for c in candidates])
+        for i, divergence in enumerate(results):
+            if divergence:
+                commands = candidates[i][:divergence[0] + 1]
+                n = 2 if i < len(chunks) else max(n - 1, 2)
+                break
+        else:
+            if n >= len(commands):
+                break
+            n = min(len(commands), 2 * n)
+        if log:
+            log.write('%d commands, granularity %d\n' % (len(commands), n))
+    return commands
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Shrink a command file on which the exec diverges from '
+                    'the simulator.')
+    parser.add_argument('commands', help='command file, e.g. '
+                                         'Wet1RandomizedTestCases-commands-00')
+    parser.add_argument('-o', '--output',
+                        help='minimized trace (default: COMMANDS-min)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--any-divergence', action='store_true',
+                        help='accept a divergence on any op, not only the '
+                             'original one')
+    args = parser.parse_args()
+
+    pool = multiprocessing.Pool(args.jobs)
+    commands = minimize(sim.read_commands(args.commands), pool,
+                        same_op=not args.any_divergence, log=sys.stderr)
+    pool.close()
+    pool.join()
+    with open(args.output or args.commands + '-min', 'w') as f:
+        for name, args_ in commands:
+            line = sim.format_command(name, *args_)
+            f.write(line + '\n')
+            sys.stdout.write(line + '\n')
+    index, name, expected, actual = first_divergence(commands)
+    sys.stdout.write('%s: "%s" != "%s"\n' % (name, actual, expected))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+import argparse
+import collections
+import itertools
+import select
+import sys
+import time
+import simulator as sim
+import trace_generator
+
+
+class _Trace(object):
+    def __init__(self, key, commands, proxy, simulator, expected):
+        self.key = key
+        self.commands = enumerate(commands)
+        self.proxy = proxy
+        self.sim = simulator
+        self.expected = iter(expected)
+        self.pending = collections.deque()
+        self.matcher = sim.ReplyMatcher()
+        self.last = None
+        self.exhausted = False
+        self.last_progress = time.time()
+
+
+class Multiplexer(object):
+    """Drives many exec processes, each checked against its own simulator,
+    from a single thread.
+
+    Every trace keeps up to window commands in flight. Outstanding input is
+    kept well below the pipe buffer size, so writes never block and one
+    poll loop can serve all processes.
+    """
+
+    def __init__(self, window=64, timeout=10):
+        self.window = window
+        self.timeout = timeout
+        self._traces = {}
+        self._poller = select.poll()
+        self.results = {}
+
+    def add(self, key, commands, simulator=None, expected=(), **kwargs):
+        """Start an exec for commands, an iterable of (name, args).
+
+        The first commands can come with known expected outputs; the
+        simulator (a fresh Wet1Sim by default) only runs once they are used
+        up, so it has to be in the state those commands leave it in.
+        """
+        t = _Trace(key, commands, sim.Wet1Proxy(**kwargs),
+                   simulator or sim.Wet1Sim(), expected)
+        self._traces[t.proxy.fileno()] = t
+        self._poller.register(t.proxy.fileno(), select.POLLIN)
+        self._refill(t)
+
+    def _refill(self, t):
+        want = self.window - len(t.pending)
+        if t.exhausted or want < self.window // 2:
+            return
+        chunk = list(itertools.islice(t.commands, want))
+        if len(chunk) < want:
+            t.exhausted = True
+        t.pending.extend(chunk)
+        t.proxy.send(t.matcher.add([sim.format_command(name, *args)
+                                    for _, (name, args) in chunk]))
+        if t.exhausted and not len(t.matcher):
+            self._finish(t, None)
+
+    def _finish(self, t, result):
+        self.results[t.key] = result
+        fd = t.proxy.fileno()
+        self._poller.unregister(fd)
+        del self._traces[fd]
+        t.proxy._proc.kill()
+        t.proxy._proc.wait()
+
+    def _expected(self, t, name, args):
+        for expected in t.expected:
+            return expected
+        return getattr(t.sim, name)(*args).strip()
+
+    def _check(self, t, line):
+        for output in t.matcher.feed(line):
+            index, (name, args) = t.last = t.pending.popleft()
+            expected = self._expected(t, name, args)
+            output = output.strip()
+            if expected != output:
+                self._finish(t, (index, name, expected, output))
+                return False
+        if t.matcher.unexpected:
+            # A line after the reply of the last command sent, reported as
+            # a divergence of that command.
+            index, (name, args) = t.last
+            self._finish(t, (index, name, sim.NO_OUTPUT.strip(),
+                             t.matcher.unexpected[0].strip()))
+            return False
+        return True
+
+    def _fail_pending(self, t, marker):
+        # The marker settles a held reply or fails the next command.
+        while len(t.matcher):
+            if not self._check(t, marker):
+                return
+        self._finish(t, None)
+
+    def run(self):
+        """Run until every trace is done.
+
+        Returns {key: None or (index, name, expected, actual)} where the
+        tuple is the first divergence of that trace.
+        """
+        while self._traces:
+            for fd, _ in self._poller.poll(100):
+                t = self._traces.get(fd)
+                if t is None:
+                    continue
+                lines, alive = t.proxy.receive()
+                t.last_progress = time.time()
+                if not all(self._check(t, line) for line in lines):
+                    continue
+                if not len(t.matcher) and t.exhausted:
+                    self._finish(t, None)
+                elif not alive:
+                    self._fail_pending(t, sim.PROCESS_DIED)
+                else:
+                    self._refill(t)
+            now = time.time()
+            for t in self._traces.values():
+                if len(t.matcher) and now - t.last_progress > self.timeout:
+                    self._fail_pending(t, sim.TIMED_OUT)
+        return self.results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check many traces concurrently, each on its own exec, '
+                    'from a single thread.')
+    parser.add_argument('commands', nargs='*', help='command files')
+    parser.add_argument('--fuzz', type=int, default=0, metavar='N',
+                        help='also run N generated fuzz traces')
+    parser.add_argument('--length', type=int, default=100000,
+                        help='commands per fuzz trace')
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help='seed of the first fuzz trace')
+    parser.add_argument('-k', '--firms', type=int, default=5)
+    parser.add_argument('--window', type=int, default=64)
+    args = parser.parse_args()
+
+    m = Multiplexer(args.window)
+    for path in args.commands:
+        m.add(path, sim.read_commands(path))
+    for seed in xrange(args.seed, args.seed + args.fuzz):
+        gen = trace_generator.TraceGenerator(seed, args.firms, (0, 5),
+                                             (0, 5), invalid=0.1)
+        m.add('seed %d' % seed, gen.generate(
+            [(args.length, trace_generator.PHASES['mix'])]))
+    failed = 0
+    for key, result in sorted(m.run().items()):
+        if result:
+            failed += 1
+            index, name, expected, actual = result
+            sys.stdout.write('%s ... FAIL at command %d, %s: "%s" != "%s"\n'
+                             % (key, index, name, actual, expected))
+        else:
+            sys.stdout.write('%s ... ok\n' % key)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
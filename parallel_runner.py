@@ -0,0 +1,109 @@
+#!/usr/bin/python
+import argparse
+import datetime
+import importlib
+import multiprocessing
+import os
+import sys
+import time
+import unittest
+
+# Test output subdirectory of each suite, as used by the suites themselves.
+SUITES = {
+    'simple_tests': 'simple',
+    'randomized_tests': 'random',
+}
+
+
+def list_tests(module_name):
+    module = importlib.import_module(module_name)
+    tests = []
+
+    def walk(suite):
+        for t in suite:
+            if isinstance(t, unittest.TestSuite):
+                walk(t)
+            else:
+                tests.append(t.id().split('.', 1)[1])
+    walk(unittest.defaultTestLoader.loadTestsFromModule(module))
+    return tests
+
+
+def run_test(job):
+    """Run a single test in a worker; returns (status, traceback, seconds)."""
+    module_name, test_name, index, output_path = job
+    module = importlib.import_module(module_name)
+    # Every test gets the number it would have had in a serial run, so the
+    # artifact names never collide between workers.
+    module.TEST_OUTPUT_PATH = output_path
+    module.glob_ctr = index
+    test = unittest.defaultTestLoader.loadTestsFromName(test_name, module)
+    result = unittest.TestResult()
+    start = time.time()
+    test.run(result)
+    elapsed = time.time() - start
+    for status, problems in (('ERROR', result.errors),
+                             ('FAIL', result.failures)):
+        if problems:
+            return status, problems[0][1], elapsed
+    return 'ok', None, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run wet1 test suites over a pool of processes.')
+    parser.add_argument('suites', nargs='*', metavar='suite',
+                        help='one of %s (default: all)' % ', '.join(
+                            sorted(SUITES)))
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+    suites = args.suites or sorted(SUITES)
+    for module_name in suites:
+        if module_name not in SUITES:
+            parser.error('unknown suite %s' % module_name)
+
+    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+    jobs = []
+    for module_name in suites:
+        output_path = os.path.join(os.getcwd(), 'test-output',
+                                   SUITES[module_name], timestamp)
+        os.makedirs(output_path)
+        for index, test_name in enumerate(list_tests(module_name)):
+            jobs.append((module_name, test_name, index, output_path))
+
+    start = time.time()
+    pool = multiprocessing.Pool(args.jobs)
+    results = []
+    for job, result in zip(jobs, pool.imap(run_test, jobs)):
+        results.append((job, result))
+        sys.stdout.write({'ok': '.', 'FAIL': 'F', 'ERROR': 'E'}[result[0]])
+        sys.stdout.flush()
+    pool.close()
+    pool.join()
+    elapsed = time.time() - start
+
+    lines = []
+    for (module_name, test_name, index, _), (status, tb, secs) in results:
+        lines.append('%s.%s (%02d) ... %s [%.3fs]' % (module_name, test_name,
+                                                      index, status, secs))
+    for (module_name, test_name, _, _), (status, tb, _) in results:
+        if tb:
+            lines.extend(['', '=' * 70,
+                          '%s: %s.%s' % (status, module_name, test_name),
+                          '-' * 70, tb.rstrip()])
+    bad = [r for _, r in results if r[0] != 'ok']
+    lines.extend(['', '-' * 70,
+                  'Ran %d tests in %.3fs on %d workers' % (len(results),
+                                                           elapsed, args.jobs),
+                  '', 'FAILED (%d)' % len(bad) if bad else 'OK'])
+    report = '\n'.join(lines) + '\n'
+    with open(os.path.join(os.getcwd(), 'test-output',
+                           'report-%s.txt' % timestamp), 'w') as f:
+        f.write(report)
+    sys.stdout.write('\n' + report)
+    return 1 if bad else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+import argparse
+import json
+import os
+import sys
+import simulator as sim
+
+
+def callgrind_costs(path):
+    """Instruction count of each part of a combined callgrind dump."""
+    costs = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith('part:'):
+                costs.append(None)
+            elif line.startswith(('totals:', 'summary:')):
+                cost = int(line.split()[1])
+                if not costs:
+                    costs.append(cost)
+                elif costs[-1] is None or line.startswith('totals:'):
+                    costs[-1] = cost
+    return costs
+
+
+def profile(commands, output_dir, marker='read'):
+    """Run commands under callgrind and return (name, instructions) pairs.
+
+    Callgrind dumps its counters every time the exec enters the marker
+    function. Commands are sent one at a time, each only after the previous
+    one was answered, so every read of stdin returns exactly one command
+    and each dump holds the cost of exactly one of them. Instruction counts
+    do not depend on machine load, so runs of the same exec on the same
+    trace give the same table.
+    """
+    commands = list(commands)
+    if not commands or commands[-1][0] != 'Quit':
+        commands.append(('Quit', ()))
+    out = os.path.join(output_dir, 'callgrind.out')
+    p = sim.Wet1Proxy(valgrind=True, timeout=60,
+                      valgrind_log=os.path.join(output_dir, 'valgrind.log'),
+                      valgrind_args=['--tool=callgrind',
+                                     '--dump-before=%s' % marker,
+                                     '--combine-dumps=yes',
+                                     '--callgrind-out-file=%s' % out])
+    for name, args in commands:
+        getattr(p, name)(*args)
+    # An empty line ends the exec, which makes callgrind write its output.
+    p.send([''])
+    p._proc.wait()
+    # The first dump covers startup up to the first read of a command, the
+    # last one the read of the empty line and the exit.
+    costs = callgrind_costs(out)[1:-1]
+    if len(costs) != len(commands):
+        raise RuntimeError('%d dumps for %d commands, the exec does not read '
+                           'commands through %s' % (len(costs), len(commands),
+                                                    marker))
+    return [(name, cost) for (name, _), cost in zip(commands, costs)]
+
+
+def cost_table(costs):
+    table = {}
+    for name, cost in costs:
+        row = table.setdefault(name, {'count': 0, 'total': 0,
+                                      'min': cost, 'max': cost})
+        row['count'] += 1
+        row['total'] += cost
+        row['min'] = min(row['min'], cost)
+        row['max'] = max(row['max'], cost)
+    for row in table.values():
+        row['mean'] = float(row['total']) / row['count']
+    return table
+
+
+def format_table(table):
+    lines = ['%-18s %8s %14s %12s %12s %12s' % ('command', 'count', 'total Ir',
+                                                'mean', 'min', 'max')]
+    for name, row in sorted(table.items()):
+        lines.append('%-18s %8d %14d %12.1f %12d %12d' % (
+            name, row['count'], row['total'], row['mean'], row['min'],
+            row['max']))
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Count instructions the exec spends on each command of '
+                    'a trace, using valgrind --tool=callgrind.')
+    parser.add_argument('commands', help='command file')
+    parser.add_argument('-d', '--output-dir', default='.',
+                        help='where callgrind output is kept')
+    parser.add_argument('--marker', default='read',
+                        help='function the exec calls once per command read '
+                             '(default: %(default)s)')
+    parser.add_argument('--json', help='also write the cost table as JSON')
+    args = parser.parse_args()
+
+    costs = profile(sim.read_commands(args.commands), args.output_dir,
+                    args.marker)
+    table = cost_table(costs)
+    sys.stdout.write(format_table(table))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'commands': costs, 'table': table}, f, indent=2,
+                      sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
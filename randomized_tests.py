@@ -1,6 +1,7 @@
 #!/usr/bin/python
 import datetime
 import functools
+import multiprocessing.util
 import os
 import random
 import unittest
@@ -8,6 +9,10 @@ import simulator as sim
 
 glob_ctr = 0
 DO_VALGRIND = int(os.environ.get('WET1_VALGRIND', 0)) == 1
+MEMORY_EVERY = int(os.environ.get('WET1_MEMORY', 0))
+DO_LATENCY = int(os.environ.get('WET1_LATENCY', 0)) == 1
+DO_WARM = int(os.environ.get('WET1_WARM', 0)) == 1
+WARM_POOL = None
 
 
 def emit_test_name(func):
@@ -24,26 +29,51 @@ class Wet1RandomizedTestCases(unittest.TestCase):
         global glob_ctr
         global TEST_OUTPUT_PATH
         global DO_VALGRIND
+        global WARM_POOL
         cls_name = self.__class__.__name__
         make_name = lambda infix: os.path.join(TEST_OUTPUT_PATH,
                                                '%s-%s-%02d' % (cls_name,
                                                                infix,
                                                                glob_ctr))
+        proxy = None
+        if DO_WARM:
+            if WARM_POOL is None:
+                WARM_POOL = sim.Wet1ProxyPool(
+                    valgrind=DO_VALGRIND,
+                    valgrind_log=os.path.join(TEST_OUTPUT_PATH,
+                                              '%s-valgrind-warm-%d-%%02d' %
+                                              (cls_name, os.getpid())))
+                # Unlike atexit, this also runs in parallel_runner's pool
+                # workers, which leave through os._exit.
+                multiprocessing.util.Finalize(WARM_POOL, WARM_POOL.close,
+                                              exitpriority=0)
+            proxy = WARM_POOL.acquire(make_name('commands'))
+        memory_log = make_name('memory') if MEMORY_EVERY else None
         self.sp = sim.SimulatedWet1Proxy(command_log=make_name('commands'),
                                          valgrind=DO_VALGRIND,
                                          valgrind_log=make_name('valgrind'),
                                          proxy_output=make_name('out-actual'),
-                                         sim_output=make_name('out-expected'))
+                                         sim_output=make_name('out-expected'),
+                                         memory_log=memory_log,
+                                         memory_every=MEMORY_EVERY or 1,
+                                         latency_log=(make_name('latency')
+                                                      if DO_LATENCY else None),
+                                         proxy=proxy)
         glob_ctr += 1
 
     def tearDown(self):
         # self.sp._p._proc.kill()
-        try:
-            self.sp.Quit()
-        except:
-            pass
-        self.sp._p._proc.stdin.write('\n\n')
-        self.sp._p._proc.wait()
+        if DO_WARM:
+            self.sp.close()
+            WARM_POOL.release(self.sp._p)
+        else:
+            try:
+                self.sp.Quit()
+            except:
+                pass
+            self.sp._p._proc.stdin.write('\n\n')
+            self.sp._p._proc.wait()
+            self.sp.close()
         del self.sp
 
     def testFuzz(self):
@@ -52,31 +82,34 @@ class Wet1RandomizedTestCases(unittest.TestCase):
                    'HireBySalary', 'Fire', 'Bonus', 'GetNumEmployed',
                    'HighestPaid', 'CutBacks', 'Quit']
         get_rand = lambda: random.randint(-1, order)
-        self.sp.Init(order)
-        for _ in xrange(order ** 7):
-            action = random.choice(actions)
-            if action == 'Init':
-                # self.sp.Init(get_rand())
-                pass
-            elif action == 'AddJobSearcher':
-                self.sp.AddJobSearcher(get_rand(), get_rand())
-            elif action == 'RemoveJobSearcher':
-                self.sp.RemoveJobSearcher(get_rand())
-            elif action == 'Hire':
-                self.sp.Hire(get_rand(), get_rand())
-            elif action == 'HireBySalary':
-                self.sp.HireBySalary(get_rand(), get_rand())
-            elif action == 'Fire':
-                self.sp.Fire(get_rand(), get_rand())
-            elif action == 'Bonus':
-                self.sp.Bonus(get_rand(), get_rand(), get_rand())
-            elif action == 'GetNumEmployed':
-                self.sp.GetNumEmployed(get_rand())
-            elif action == 'HighestPaid':
-                self.sp.HighestPaid(get_rand())
-            elif action == 'CutBacks':
-                self.sp.CutBacks(get_rand(), get_rand(), get_rand())
 
+        def commands():
+            for _ in xrange(order ** 7):
+                action = random.choice(actions)
+                if action == 'Init':
+                    # yield 'Init', (get_rand(),)
+                    pass
+                elif action == 'AddJobSearcher':
+                    yield action, (get_rand(), get_rand())
+                elif action == 'RemoveJobSearcher':
+                    yield action, (get_rand(),)
+                elif action == 'Hire':
+                    yield action, (get_rand(), get_rand())
+                elif action == 'HireBySalary':
+                    yield action, (get_rand(), get_rand())
+                elif action == 'Fire':
+                    yield action, (get_rand(), get_rand())
+                elif action == 'Bonus':
+                    yield action, (get_rand(), get_rand(), get_rand())
+                elif action == 'GetNumEmployed':
+                    yield action, (get_rand(),)
+                elif action == 'HighestPaid':
+                    yield action, (get_rand(),)
+                elif action == 'CutBacks':
+                    yield action, (get_rand(), get_rand(), get_rand())
+
+        self.sp.Init(order)
+        self.sp.run_batch(commands())
 
 if __name__ == '__main__':
     timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
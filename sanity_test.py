@@ -1,4 +1,5 @@
 #!/usr/bin/python
+import random
 import unittest
 import simulator as sim
 
@@ -14,5 +15,114 @@ class Wet1TestCases(unittest.TestCase):
     def testSanity(self):
         pass
 
+
+class SalaryIndexTestCases(unittest.TestCase):
+    """SalaryIndex against a plain dict, since the simulator built on it is
+    the reference every exec is compared to."""
+
+    def testAgainstDict(self):
+        rand = random.Random(0)
+        index, model, nodes = sim.SalaryIndex(), {}, {}
+        key = lambda e: (e.salary, e.id) if e is not None else None
+        for _ in xrange(50000):
+            op = rand.random()
+            if op < 0.35:
+                id = rand.randrange(2000)
+                if id not in model:
+                    model[id] = rand.randrange(1000)
+                    nodes[id] = sim.Employee(id, model[id])
+                    index.insert(nodes[id])
+            elif op < 0.55 and model:
+                id = rand.choice(list(model))
+                self.assertEqual(index.remove(nodes.pop(id)), model.pop(id))
+            elif op < 0.7:
+                thd = rand.randrange(1000)
+                cut = rand.randint(0, thd)
+                index.cut_from(thd, cut)
+                for id in model:
+                    if model[id] >= thd:
+                        model[id] -= cut
+            elif op < 0.85:
+                salary = rand.randrange(1000)
+                below = [(s, id) for id, s in model.items() if s <= salary]
+                self.assertEqual(key(index.floor(salary)),
+                                 max(below) if below else None)
+            else:
+                self.assertEqual(key(index.max()), max((s, id) for id, s in
+                                                       model.items())
+                                 if model else None)
+            if model and rand.random() < 0.05:
+                id = rand.choice(list(model))
+                self.assertEqual(index.salary_of(nodes[id]), model[id])
+            self.assertEqual(len(index), len(model))
+
+
+class ReplyMatcherTestCases(unittest.TestCase):
+    QUERIES = ['Init 3', 'AddJobSearcher 1 5', 'Hire 0 1', 'Fire 0 1',
+               'GetNumEmployed 0', 'HighestPaid 0', 'HighestPaid 1']
+
+    def match(self, replies):
+        """Outputs of QUERIES given the lines an exec wrote for them, with
+        the sync comments echoed."""
+        matcher = sim.ReplyMatcher()
+        lines = matcher.add(self.QUERIES)
+        self.assertEqual(lines.count(sim.SYNC), 2)
+        outputs = []
+        for line in replies:
+            outputs.extend(matcher.feed(line + '\n'))
+        self.assertEqual(len(matcher), 0)
+        return [o.strip() for o in outputs], matcher.unexpected
+
+    def testInOrder(self):
+        replies = ['Init done.', 'AddJobSearcher: Success', 'Hire: Success',
+                   'Fire: Success', 'GetNumEmployed: Success 0',
+                   'HighestPaid: Failure', '#sync', 'HighestPaid: Failure',
+                   '#sync']
+        self.assertEqual(self.match(replies),
+                         ([r for r in replies if r != '#sync'], []))
+
+    def testSkipped(self):
+        outputs, extra = self.match(
+            ['Init done.', 'AddJobSearcher: Success', 'Fire: Success',
+             'GetNumEmployed: Success 0', '#sync', 'HighestPaid: Failure',
+             '#sync'])
+        self.assertEqual(outputs[2:4], [sim.NO_OUTPUT.strip(),
+                                        'Fire: Success'])
+        self.assertEqual(outputs[5], sim.NO_OUTPUT.strip())
+        self.assertEqual(len(outputs), len(self.QUERIES))
+        self.assertEqual(extra, [])
+
+    def testMislabeled(self):
+        outputs, extra = self.match(
+            ['Init done.', 'AddJobSearcher: Success', 'Hire: Success',
+             'Hire: Success', 'GetNumEmployed: Success 1',
+             'HighestPaid: Success 1', '#sync', 'HighestPaid: Failure',
+             '#sync'])
+        self.assertEqual(outputs[3], 'Hire: Success')
+        self.assertEqual(outputs[4:], ['GetNumEmployed: Success 1',
+                                       'HighestPaid: Success 1',
+                                       'HighestPaid: Failure'])
+        self.assertEqual(extra, [])
+
+    def testExtra(self):
+        outputs, extra = self.match(
+            ['Init done.', 'AddJobSearcher: Success', 'Hire: Success',
+             'Fire: Success', 'GetNumEmployed: Success 0',
+             'HighestPaid: Failure', 'HighestPaid: Failure', '#sync',
+             'HighestPaid: Failure', '#sync', 'Quit done.'])
+        self.assertEqual(outputs[5], 'HighestPaid: Failure\n'
+                                     'HighestPaid: Failure')
+        self.assertEqual(outputs[6], 'HighestPaid: Failure')
+        self.assertEqual(extra, ['Quit done.\n'])
+
+    def testMarkers(self):
+        matcher = sim.ReplyMatcher()
+        matcher.add(['Init 3', 'Quit'])
+        outputs = matcher.feed('Init done.\n')
+        while len(matcher):
+            outputs.extend(matcher.feed(sim.PROCESS_DIED))
+        self.assertEqual(outputs, ['Init done.\n', sim.PROCESS_DIED])
+
+
 if __name__ == '__main__':
     unittest.main()
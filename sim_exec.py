@@ -0,0 +1,92 @@
+#!/usr/bin/python
+import argparse
+import os
+import sys
+import simulator as sim
+
+READ_SIZE = 1 << 16
+
+
+class LineFrontEnd(object):
+    """Runs the exec's stdin command language on a Wet1Sim.
+
+    Commands are dispatched through a table built once from
+    COMMAND_FORMATS. An empty line ends the session, as it ends the exec.
+    """
+
+    def __init__(self, s=None):
+        s = s or sim.Wet1Sim()
+        self.done = False
+        self._table = dict((name, (getattr(s, name), fmt.count('%d')))
+                           for name, fmt in sim.COMMAND_FORMATS.iteritems()
+                           if name != 'Comment')
+        self._comment = s.Comment
+        self._partial = ''
+
+    def run_line(self, line):
+        """Output of one command line (without its newline)."""
+        if line.startswith('#'):
+            return self._comment(line[1:])
+        parts = line.split()
+        if not parts:
+            self.done = True
+            return ''
+        try:
+            f, n = self._table[parts[0]]
+            if len(parts) != n + 1:
+                raise ValueError
+            return f(*map(int, parts[1:]))
+        except (KeyError, ValueError):
+            sys.stderr.write('Unknown command: %s\n' % line)
+            return ''
+
+    def run_lines(self, lines):
+        """Yield the outputs of lines until an empty one."""
+        for line in lines:
+            out = self.run_line(line.rstrip('\n'))
+            if self.done:
+                return
+            yield out
+
+    def feed(self, data):
+        """Run the complete lines of a chunk of input, keeping a partial last
+        line for the next chunk. Returns the joined outputs."""
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        return ''.join(self.run_lines(lines))
+
+
+def serve(fd_in, out):
+    """Answer commands from fd_in until an empty line or EOF, writing all
+    outputs of a read at once so pipelined input is not answered line by
+    line."""
+    front = LineFrontEnd()
+    while not front.done:
+        data = os.read(fd_in, READ_SIZE)
+        if not data:
+            break
+        out.write(front.feed(data))
+        out.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the simulator as a drop-in reference exec, reading '
+                    'commands from stdin (or files) and writing its output '
+                    'to stdout.')
+    parser.add_argument('commands', nargs='*',
+                        help='command files to stream instead of stdin')
+    args = parser.parse_args()
+
+    if not args.commands:
+        serve(sys.stdin.fileno(), sys.stdout)
+        return
+    front = LineFrontEnd()
+    for path in args.commands:
+        sys.stdout.writelines(front.run_lines(sim.read_log(path)))
+        if front.done:
+            break
+
+
+if __name__ == '__main__':
+    main()
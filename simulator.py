@@ -1,76 +1,335 @@
 #!/usr/bin/python
+import collections
+import errno
+import gzip
+import itertools
+import json
+import math
 import os
+import random
+import select
+import struct
 import subprocess
-import threading
-import Queue
+import time
 
 
-class Employee:
+class Employee(object):
+    # Slots rather than an instance dict keep large populations small, and
+    # an employee is its own node in the SalaryIndex of its firm, so there
+    # is one object per employee.
+    __slots__ = ('id', 'salary', 'firm', 'prio', 'tag', 'left', 'right',
+                 'parent')
+
     def __init__(self, id, salary):
         self.id = id
         self.salary = salary
+        self.firm = None
+        self.prio = random.random()
+        self.tag = 0
+        self.left = None
+        self.right = None
+        self.parent = None
 
 
-class Firm(object):
+class EmployeeRegistry(object):
+    """Id-keyed index of all known employees and the firm holding each."""
+
+    def __init__(self):
+        self._employees = {}
+
+    def __contains__(self, id):
+        return id in self._employees
+
+    def __len__(self):
+        return len(self._employees)
+
+    def add(self, e):
+        if e.id in self._employees:
+            raise RuntimeError('Duplicate employee')
+        self._employees[e.id] = e
+        e.firm = None
+
+    def remove(self, id):
+        if id not in self._employees:
+            raise RuntimeError('No such employee')
+        del self._employees[id]
+
+    def get(self, id):
+        try:
+            return self._employees[id]
+        except KeyError:
+            raise RuntimeError('No employee found')
+
+    def firm_of(self, id):
+        e = self._employees.get(id)
+        return e.firm if e is not None else None
+
+    def move(self, e, firm):
+        e.firm = firm
+
+
+class SalaryIndex(object):
+    """Treap of Employee nodes over (salary, id) keys with lazy salary
+    offsets.
+
+    A node's salary is exact once the pending tags of all its ancestors have
+    been pushed down, which lets cut_from() shift the salaries that keep
+    their order by tagging a single subtree. The index keeps no id lookup of
+    its own; callers hold the nodes.
+    """
+
     def __init__(self):
-        self.employees = set()
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _push(t):
+        if t.tag:
+            for c in (t.left, t.right):
+                if c is not None:
+                    c.salary += t.tag
+                    c.tag += t.tag
+            t.tag = 0
+
+    def _split(self, t, key):
+        if t is None:
+            return None, None
+        self._push(t)
+        if (t.salary, t.id) < key:
+            l, r = self._split(t.right, key)
+            t.right = l
+            if l is not None:
+                l.parent = t
+            return t, r
+        l, r = self._split(t.left, key)
+        t.left = r
+        if r is not None:
+            r.parent = t
+        return l, t
+
+    def _merge(self, a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        if a.prio > b.prio:
+            self._push(a)
+            a.right = self._merge(a.right, b)
+            a.right.parent = a
+            return a
+        self._push(b)
+        b.left = self._merge(a, b.left)
+        b.left.parent = b
+        return b
+
+    def _set_root(self, t):
+        if t is not None:
+            t.parent = None
+        self._root = t
+
+    def _insert_node(self, n):
+        l, r = self._split(self._root, (n.salary, n.id))
+        self._set_root(self._merge(self._merge(l, n), r))
+
+    def insert(self, n):
+        """Add n, which must not be in any index, at its salary."""
+        n.tag = 0
+        n.left = n.right = None
+        self._insert_node(n)
+        self._size += 1
+
+    def remove(self, n):
+        """Take n out of the index; returns its exact salary."""
+        path = []
+        p = n.parent
+        while p is not None:
+            path.append(p)
+            p = p.parent
+        for p in reversed(path):
+            self._push(p)
+        self._push(n)
+        m = self._merge(n.left, n.right)
+        p = n.parent
+        if p is None:
+            self._set_root(m)
+        else:
+            if p.left is n:
+                p.left = m
+            else:
+                p.right = m
+            if m is not None:
+                m.parent = p
+        n.left = n.right = n.parent = None
+        self._size -= 1
+        return n.salary
+
+    def salary_of(self, n):
+        salary = n.salary
+        p = n.parent
+        while p is not None:
+            salary += p.tag
+            p = p.parent
+        return salary
+
+    def floor(self, salary):
+        t, best = self._root, None
+        while t is not None:
+            self._push(t)
+            if t.salary <= salary:
+                best = t
+                t = t.right
+            else:
+                t = t.left
+        return best
+
+    def max(self):
+        t = self._root
+        if t is None:
+            return None
+        self._push(t)
+        while t.right is not None:
+            t = t.right
+            self._push(t)
+        return t
+
+    def _flatten(self, t):
+        """Nodes of t in key order, with their tags pushed down."""
+        nodes, stack = [], []
+        while stack or t is not None:
+            if t is not None:
+                self._push(t)
+                stack.append(t)
+                t = t.left
+            else:
+                t = stack.pop()
+                nodes.append(t)
+                t = t.right
+        return nodes
+
+    @staticmethod
+    def _build(nodes):
+        """Treap of nodes sorted by key, in O(n) from their priorities."""
+        stack = []
+        for n in nodes:
+            last = None
+            while stack and stack[-1].prio < n.prio:
+                last = stack.pop()
+            n.left, n.right = last, None
+            if last is not None:
+                last.parent = n
+            if stack:
+                stack[-1].right = n
+                n.parent = stack[-1]
+            stack.append(n)
+        return stack[0] if stack else None
+
+    def cut_from(self, thd, cut):
+        """Subtract cut from every salary >= thd, for 0 <= cut <= thd.
+
+        Salaries of thd + cut and up keep their order and are shifted by
+        tagging one subtree. The band in [thd, thd + cut) can land among
+        the untouched salaries: a small band is re-inserted node by node,
+        a large one is merged in order with the salaries below thd and the
+        treap rebuilt, for O(min(band * log n, n)).
+        """
+        low, high = self._split(self._root, (thd, float('-inf')))
+        mid, high = self._split(high, (thd + cut, float('-inf')))
+        if high is not None:
+            high.salary -= cut
+            high.tag -= cut
+        moved = self._flatten(mid)
+        for t in moved:
+            t.salary -= cut
+        if len(moved) * math.log(self._size + 1, 2) < self._size:
+            self._set_root(self._merge(low, high))
+            for t in moved:
+                t.left = t.right = None
+                self._insert_node(t)
+            return
+        nodes = self._flatten(low)
+        nodes.extend(moved)
+        # Two sorted runs, which the sort merges in linear time.
+        nodes.sort(key=lambda t: (t.salary, t.id))
+        self._set_root(self._merge(self._build(nodes), high))
+
+
+class Firm(object):
+    # Membership is the employee's firm field and the salary index, so a
+    # firm keeps no separate set of its employees.
+    def __init__(self, registry):
+        self._registry = registry
+        self._by_salary = SalaryIndex()
+
+    def __len__(self):
+        return len(self._by_salary)
 
     def add_employee(self, e):
-        if e in self.employees:
+        if e.firm is self:
             raise RuntimeError('Duplicate employee')
-        self.employees.add(e)
+        self._by_salary.insert(e)
+        self._registry.move(e, self)
 
     def remove_employee(self, e):
-        if not (e in self.employees):
+        if e.firm is not self:
             raise RuntimeError('No such employee')
-        self.employees.remove(e)
+        self._by_salary.remove(e)
+        self._registry.move(e, None)
 
     def get_employee(self, id):
-        candidates = filter(lambda x: x.id == id, self.employees)
-        if len(candidates) == 0:
+        if self._registry.firm_of(id) is not self:
             raise RuntimeError('No employee found')
-        return candidates[0]
+        return self._registry.get(id)
+
+    # Employee.salary of a firm member can lag behind the pending offsets of
+    # its ancestors in the index; it is exact again once the employee leaves
+    # the firm.
+    def salary_of(self, e):
+        return self._by_salary.salary_of(e)
 
 
 class RecruitmentFirm(Firm):
-    def __init__(self):
-        Firm.__init__(self)
+    def __init__(self, registry):
+        Firm.__init__(self, registry)
 
     def find_by_salary(self, salary):
-        candidates = list(filter(lambda x: x.salary <= salary, self.employees))
-        if len(candidates) > 0:
-            return max(candidates, key=lambda x: (x.salary, x.id))
+        return self._by_salary.floor(salary)
 
 
 class HighTechFirm(Firm):
-    def __init__(self):
-        Firm.__init__(self)
+    def __init__(self, registry):
+        Firm.__init__(self, registry)
 
     def num_employees(self):
-        return len(self.employees)
+        return len(self)
 
     def highest_paid(self):
-        if len(self.employees) > 0:
-            return sorted(self.employees, key=lambda x: (x.salary, x.id))[-1]
-        raise RuntimeError()
+        e = self._by_salary.max()
+        if e is None:
+            raise RuntimeError()
+        return e
+
+    def bonus(self, id, bonus):
+        e = self.get_employee(id)
+        e.salary = self._by_salary.remove(e) + bonus
+        self._by_salary.insert(e)
 
     def cutbacks(self, thd, cut):
-        def cut_salary(e):
-            if e.salary >= thd:
-                e.salary -= cut
-        map(lambda x: cut_salary(x), self.employees)
+        self._by_salary.cut_from(thd, cut)
 
 
 class Wet1Sim(object):
     def __init__(self, *args, **kwargs):
         self._init = False
-        self.ged = {}
+        self.ged = EmployeeRegistry()
 
     def Init(self, k):
         if (self._init):
             return 'Init was already called.\n'
-        self.recr = RecruitmentFirm()
-        self.firms = list(map(lambda x: HighTechFirm(), xrange(k)))
+        self.recr = RecruitmentFirm(self.ged)
+        self.firms = list(map(lambda x: HighTechFirm(self.ged), xrange(k)))
         self._init = True
         return 'Init done.\n'
 
@@ -78,10 +337,9 @@ class Wet1Sim(object):
         if (id < 0 or salary < 0):
             return 'AddJobSearcher: Invalid_input\n'
         try:
-            if id in self.ged:
-                raise RuntimeError('Duplicate employee')
-            self.ged[id] = Employee(id, salary)
-            self.recr.add_employee(self.ged[id])
+            e = Employee(id, salary)
+            self.ged.add(e)
+            self.recr.add_employee(e)
         except (RuntimeError):
             return 'AddJobSearcher: Failure\n'
         return 'AddJobSearcher: Success\n'
@@ -90,10 +348,8 @@ class Wet1Sim(object):
         if (id < 0):
             return 'RemoveJobSearcher: Invalid_input\n'
         try:
-            if not id in self.ged:
-                raise RuntimeError('No such employee')
             self.recr.remove_employee(self.recr.get_employee(id))
-            del self.ged[id]
+            self.ged.remove(id)
         except (RuntimeError):
             return 'RemoveJobSearcher: Failure\n'
         return 'RemoveJobSearcher: Success\n'
@@ -126,8 +382,7 @@ class Wet1Sim(object):
         if (cid < 0 or cid >= len(self.firms) or id < 0 or bonus < 0):
             return 'Bonus: Invalid_input\n'
         try:
-            e = self.firms[cid].get_employee(id)
-            e.salary += bonus
+            self.firms[cid].bonus(id, bonus)
         except (RuntimeError):
             return 'Bonus: Failure\n'
         return 'Bonus: Success\n'
@@ -166,7 +421,7 @@ class Wet1Sim(object):
                 or cut > thd):
             return 'CutBacks: Invalid_input\n'
         try:
-            if len(self.firms[cid].employees) < 1:
+            if len(self.firms[cid]) < 1:
                 raise RuntimeError()
             self.firms[cid].cutbacks(thd, cut)
         except (RuntimeError):
@@ -177,85 +432,615 @@ class Wet1Sim(object):
         self._init = False
         del self.recr
         del self.firms
+        self.ged = EmployeeRegistry()
         return 'Quit done.\n'
 
     def Comment(self, c):
         return '#%s\n' % c
 
+    def live_employees(self):
+        return len(self.ged) if self._init else 0
+
+    def num_firms(self):
+        return len(self.firms) if self._init else 0
+
+
+COMMAND_FORMATS = {
+    'Init': 'Init %d',
+    'AddJobSearcher': 'AddJobSearcher %d %d',
+    'RemoveJobSearcher': 'RemoveJobSearcher %d',
+    'Hire': 'Hire %d %d',
+    'HireBySalary': 'HireBySalary %d %d',
+    'Bonus': 'Bonus %d %d %d',
+    'Fire': 'Fire %d %d',
+    'GetNumEmployed': 'GetNumEmployed %d',
+    'HighestPaid': 'HighestPaid %d',
+    'CutBacks': 'CutBacks %d %d %d',
+    'Quit': 'Quit',
+    'Comment': '#%s',
+}
+
+
+def format_command(name, *args):
+    return COMMAND_FORMATS[name] % args
+
+
+def command_name(query):
+    """'Hire 1 2' -> 'Hire', '#...' -> 'Comment'."""
+    if query.startswith('#'):
+        return 'Comment'
+    return query.split(' ', 1)[0]
+
+
+def reply_name(line):
+    """Command a reply line answers: 'Hire: Success' -> 'Hire', 'Init done.'
+    -> 'Init', '#...' -> 'Comment'; None if the line answers no command."""
+    if line.startswith('#'):
+        return 'Comment'
+    name = line.split(':', 1)[0].split(' ', 1)[0].strip()
+    if name in COMMAND_FORMATS:
+        return name
+
+
+def parse_command(line):
+    """Inverse of format_command: 'Hire 1 2' -> ('Hire', (1, 2))."""
+    if line.startswith('#'):
+        return 'Comment', (line[1:],)
+    parts = line.split()
+    return parts[0], tuple(int(x) for x in parts[1:])
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError('zstd logs need the zstandard module')
+    return zstandard
+
+
+def read_log(path):
+    """Yield the lines of a log, decompressing .gz and .zst logs."""
+    if path.endswith('.zst'):
+        with open(path, 'rb') as f:
+            partial = ''
+            for chunk in _zstandard().ZstdDecompressor().read_to_iter(f):
+                lines = (partial + chunk).split('\n')
+                partial = lines.pop()
+                for line in lines:
+                    yield line + '\n'
+            if partial:
+                yield partial
+        return
+    with (gzip.open(path, 'rb') if path.endswith('.gz') else
+          open(path)) as f:
+        for line in f:
+            yield line
+
+
+def read_commands(path):
+    for line in read_log(path):
+        line = line.rstrip('\n')
+        if line.strip():
+            yield parse_command(line)
+
+
+PATH_TO_EXEC = os.environ.get('WET1_EXEC')
+
+# Artifact log settings: compression ('gz' or 'zst'), keeping only the
+# logs of failed tests, and keeping only the last N lines of each log.
+LOG_COMPRESSION = os.environ.get('WET1_LOG_COMPRESS') or None
+LOG_FAILURES_ONLY = int(os.environ.get('WET1_LOG_FAILURES_ONLY', 0)) == 1
+LOG_TAIL = int(os.environ.get('WET1_LOG_TAIL', 0))
+LOG_BUFFER_SIZE = 1 << 20
+
+
+class ArtifactLog(object):
+    """Write-only test artifact with a large buffer, optional compression
+    and an optional ring buffer of the last lines."""
+
+    def __init__(self, path, compression=LOG_COMPRESSION, tail=LOG_TAIL):
+        if compression not in (None, 'gz', 'zst'):
+            raise ValueError('Unknown log compression %s' % compression)
+        self.path = path + '.' + compression if compression else path
+        self._compression = compression
+        self._tail = collections.deque(maxlen=tail) if tail else None
+        self._raw = self._f = None
+        if self._tail is None:
+            self._open()
+
+    def _open(self):
+        self._raw = open(self.path, 'wb', LOG_BUFFER_SIZE)
+        if self._compression == 'gz':
+            self._f = gzip.GzipFile(fileobj=self._raw, mode='wb',
+                                    compresslevel=1)
+        elif self._compression == 'zst':
+            self._f = _zstandard().ZstdCompressor().stream_writer(self._raw)
+        else:
+            self._f = self._raw
 
-PATH_TO_EXEC = os.environ['WET1_EXEC']
+    def write(self, data):
+        if self._tail is not None:
+            self._tail.extend(data.splitlines(True))
+        else:
+            self._f.write(data)
+
+    def close(self, keep=True):
+        """Finish the log; with keep=False it is removed instead."""
+        if self._tail is not None:
+            if keep:
+                self._open()
+                self._f.writelines(self._tail)
+            self._tail = None
+        if self._f is None:
+            return
+        self._f.close()
+        if not self._raw.closed:
+            self._raw.close()
+        self._raw = self._f = None
+        if not keep:
+            os.remove(self.path)
+
+
+# Placeholders returned instead of an output line when the process gives
+# none; they can never equal a real response.
+NO_OUTPUT = '<no output>\n'
+PROCESS_DIED = '<process died>\n'
+TIMED_OUT = '<timed out>\n'
+
+# How long stdout has to stay quiet before the process is checked for being
+# idle, in seconds.
+IDLE_POLL = 0.01
+
+# Comment the exec echoes between pipelined queries, see ReplyMatcher.
+SYNC = '#sync'
+
+
+class ReplyMatcher(object):
+    """Pairs the output lines of pipelined queries with the queries.
+
+    Queries are sent in segments of distinct commands separated by SYNC
+    comments, and every batch ends with one so a missing reply to its last
+    query shows up without waiting. A line answering a later query of the
+    segment gives the queries it passes NO_OUTPUT; any other line is the
+    next query's output, even if it names another command. Lines arriving
+    while a SYNC is due are extra output of the query before it and are
+    appended to its output.
+    """
+
+    # Lines made up by the reader rather than written by the process; they
+    # also settle a SYNC the process never echoed.
+    MARKERS = (NO_OUTPUT, PROCESS_DIED, TIMED_OUT)
+
+    def __init__(self):
+        self._pending = collections.deque()
+        self._segment = set()
+        self._held = None
+        self.unexpected = []
+
+    def __len__(self):
+        """Number of queries and SYNC comments still waiting for a line."""
+        return len(self._pending)
+
+    def add(self, queries):
+        """Queue queries; returns the lines to write for them."""
+        lines = []
+        for q in queries:
+            name = command_name(q)
+            if name in self._segment:
+                lines.append(SYNC)
+                self._pending.append(('Comment', True))
+                self._segment.clear()
+            lines.append(q)
+            self._pending.append((name, False))
+            self._segment.add(name)
+        if lines:
+            lines.append(SYNC)
+            self._pending.append(('Comment', True))
+            self._segment.clear()
+        return lines
+
+    def _skip(self, owner):
+        """Number of queries before the one owner answers, or 0 if that is
+        not among the queries up to the next SYNC."""
+        for i, (name, sync) in enumerate(self._pending):
+            if name == owner:
+                return i
+            if sync:
+                break
+        return 0
+
+    def feed(self, line):
+        """Take an output line; returns the outputs of the queries it
+        settles, in order. The output of a query followed by a SYNC is held
+        until the SYNC is settled. Lines with no query left are kept in
+        unexpected."""
+        if not self._pending:
+            self.unexpected.append(line)
+            return []
+        outputs = []
+        owner = reply_name(line)
+        if owner is not None:
+            for _ in xrange(self._skip(owner)):
+                self._pending.popleft()
+                outputs.append(NO_OUTPUT)
+        name, sync = self._pending[0]
+        if sync:
+            if owner == 'Comment' or line in self.MARKERS:
+                self._pending.popleft()
+                if self._held is not None:
+                    outputs.append(self._held)
+                    self._held = None
+            elif self._held is not None:
+                self._held += line
+            else:
+                self.unexpected.append(line)
+            return outputs
+        self._pending.popleft()
+        if self._pending and self._pending[0][1]:
+            self._held = line
+        else:
+            outputs.append(line)
+        return outputs
 
 
 class Wet1Proxy(object):
-    def __init__(self, command_log=None, valgrind=False, valgrind_log=None):
+    def __init__(self, command_log=None, valgrind=False, valgrind_log=None,
+                 timeout=1, valgrind_args=('--leak-check=full',),
+                 exec_path=None):
         cmd = []
         if valgrind:
-            cmd = ['valgrind', '--leak-check=full']
+            cmd = ['valgrind'] + list(valgrind_args)
             if valgrind_log:
                 cmd.append('--log-file=%s' % valgrind_log)
-        cmd.append(PATH_TO_EXEC)
+        cmd.append(exec_path or PATH_TO_EXEC)
         self._proc = subprocess.Popen(cmd, bufsize=1,
                                       stdin=subprocess.PIPE,
                                       stdout=subprocess.PIPE)
-        self._queue = Queue.Queue()
-
-        def enqueue():
-            for line in iter(self._proc.stdout.readline, b''):
-                self._queue.put(line)
-
-        self._thread = threading.Thread(target=enqueue)
-        self._thread.daemon = True
-        self._thread.start()
+        self._timeout = timeout
+        self._stdout = self._proc.stdout.fileno()
+        self._poller = select.poll()
+        self._poller.register(self._stdout, select.POLLIN)
+        self._partial = ''
+        self._lines = collections.deque()
+        self._eof = False
+        self._command_log = None
+        self.set_command_log(command_log)
+        # Shared by all query_batch calls, so a sync comment still pending
+        # from an earlier batch is matched to its echo.
+        self._matcher = ReplyMatcher()
+
+    def set_command_log(self, command_log, keep=True):
+        if self._command_log:
+            self._command_log.close(keep)
         if command_log:
-            self._command_log = open(command_log, 'w')
+            self._command_log = ArtifactLog(command_log)
         else:
             self._command_log = None
 
-    def _query_proc(self, q):
-        self._proc.stdin.write(q + '\n')
-        self._proc.stdin.flush()
+    def _write(self, data):
+        try:
+            self._proc.stdin.write(data)
+            self._proc.stdin.flush()
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                raise
         if self._command_log:
-            self._command_log.write(q + '\n')
+            self._command_log.write(data)
+
+    def memory(self):
+        """(VmRSS, VmHWM) of the process in kB, or None once it is gone."""
+        values = {}
+        try:
+            with open('/proc/%d/status' % self._proc.pid) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key in ('VmRSS', 'VmHWM'):
+                        values[key] = int(value.split()[0])
+        except (IOError, OSError):
+            return None
+        if len(values) < 2:
+            return None
+        return values['VmRSS'], values['VmHWM']
+
+    @staticmethod
+    def _stat(pid):
+        """(state, parent pid) of a process, from /proc."""
+        with open('/proc/%s/stat' % pid) as f:
+            state, ppid = f.read().rsplit(')', 1)[1].split()[:2]
+        return state, int(ppid)
+
+    def _descendants_asleep(self):
+        """True if no process below ours is doing anything but sleeping, as
+        an exec started by a wrapper script that does not exec it is."""
+        children = collections.defaultdict(list)
+        states = {}
+        for name in os.listdir('/proc'):
+            if name.isdigit():
+                try:
+                    states[name], ppid = self._stat(name)
+                except (IOError, OSError, IndexError, ValueError):
+                    continue
+                children[ppid].append(name)
+        stack = list(children[self._proc.pid])
+        while stack:
+            name = stack.pop()
+            if states[name] != 'S':
+                return False
+            stack.extend(children[int(name)])
+        return True
+
+    def _is_idle(self):
+        """True if the process and its descendants are asleep with all of
+        its input consumed."""
+        try:
+            import fcntl
+            import termios
+        except ImportError:
+            return False
         try:
-            return self._queue.get(timeout=1)
-        except Queue.Empty:
-            return ''
+            if self._stat(self._proc.pid)[0] != 'S':
+                return False
+            pending = fcntl.ioctl(self._proc.stdin.fileno(), termios.FIONREAD,
+                                  struct.pack('i', 0))
+            if struct.unpack('i', pending)[0]:
+                return False
+            return self._descendants_asleep()
+        except (IOError, OSError):
+            return False
+
+    def _fill(self, timeout):
+        if not self._poller.poll(timeout * 1000):
+            return False
+        data = os.read(self._stdout, 65536)
+        if not data:
+            self._eof = True
+            if self._partial:
+                self._lines.append(self._partial)
+                self._partial = ''
+            return True
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        self._lines.extend(line + '\n' for line in lines)
+        return True
+
+    def _read_line(self):
+        deadline = time.time() + self._timeout
+        idle = False
+        while not self._lines:
+            if self._eof:
+                return PROCESS_DIED
+            now = time.time()
+            if now >= deadline:
+                return TIMED_OUT
+            if self._fill(min(deadline - now, IDLE_POLL)):
+                idle = False
+            elif self._is_idle():
+                # Require two quiet polls in a row so a process caught
+                # between reading a command and answering it is not missed.
+                if idle:
+                    return NO_OUTPUT
+                idle = True
+            else:
+                idle = False
+        return self._lines.popleft()
+
+    def _query_proc(self, q):
+        self._write(q + '\n')
+        return self._read_line()
+
+    def fileno(self):
+        return self._stdout
+
+    def send(self, queries):
+        """Write queries without waiting for their responses."""
+        self._write(''.join(q + '\n' for q in queries))
+
+    def receive(self):
+        """Collect output without blocking; returns (lines, alive)."""
+        while self._fill(0) and not self._eof:
+            pass
+        lines = list(self._lines)
+        self._lines.clear()
+        return lines, not self._eof
+
+    def query_batch(self, queries, window=256):
+        """Pipeline queries to the process, window of them per write.
+
+        Yields one output line per query, in order, matched to the queries
+        by a ReplyMatcher so a query the process does not answer yields
+        NO_OUTPUT rather than shifting the responses after it.
+        """
+        queries = iter(queries)
+        matcher = self._matcher
+        while True:
+            chunk = list(itertools.islice(queries, window))
+            if not chunk:
+                return
+            self._write(''.join(q + '\n' for q in matcher.add(chunk)))
+            while len(matcher):
+                for output in matcher.feed(self._read_line()):
+                    yield output
 
     def Init(self, k):
-        return self._query_proc('Init %d' % k)
+        return self._query_proc(format_command('Init', k))
 
     def AddJobSearcher(self, id, salary):
-        return self._query_proc('AddJobSearcher %d %d' % (id, salary))
+        return self._query_proc(format_command('AddJobSearcher', id, salary))
 
     def RemoveJobSearcher(self, id):
-        return self._query_proc('RemoveJobSearcher %d' % id)
+        return self._query_proc(format_command('RemoveJobSearcher', id))
 
     def Hire(self, cid, id):
-        return self._query_proc('Hire %d %d' % (cid, id))
+        return self._query_proc(format_command('Hire', cid, id))
 
     def HireBySalary(self, cid, thd):
-        return self._query_proc('HireBySalary %d %d' % (cid, thd))
+        return self._query_proc(format_command('HireBySalary', cid, thd))
 
     def Bonus(self, cid, id, bonus):
-        return self._query_proc('Bonus %d %d %d' % (cid, id, bonus))
+        return self._query_proc(format_command('Bonus', cid, id, bonus))
 
     def Fire(self, cid, id):
-        return self._query_proc('Fire %d %d' % (cid, id))
+        return self._query_proc(format_command('Fire', cid, id))
 
     def GetNumEmployed(self, cid):
-        return self._query_proc('GetNumEmployed %d' % cid)
+        return self._query_proc(format_command('GetNumEmployed', cid))
 
     def HighestPaid(self, cid):
-        return self._query_proc('HighestPaid %d' % cid)
+        return self._query_proc(format_command('HighestPaid', cid))
 
     def CutBacks(self, cid, thd, cut):
-        return self._query_proc('CutBacks %d %d %d' % (cid, thd, cut))
+        return self._query_proc(format_command('CutBacks', cid, thd, cut))
 
     def Quit(self):
-        return self._query_proc('Quit')
+        return self._query_proc(format_command('Quit'))
 
     def Comment(self, c):
-        return self._query_proc('#%s' % c)
+        return self._query_proc(format_command('Comment', c))
+
+
+class Wet1ProxyPool(object):
+    """Warm execs reused across tests instead of one spawn per test.
+
+    A released exec is reset with Quit, so the next test starts with Init on
+    the same process. Execs that died, answer Quit wrongly or have output
+    left over are replaced by fresh ones. Under valgrind, a leak report
+    covers every test its process served.
+    """
+
+    MARKER = 'warm-pool-check'
+
+    def __init__(self, valgrind_log=None, **kwargs):
+        self._valgrind_log = valgrind_log
+        self._kwargs = kwargs
+        self._idle = []
+        self.spawned = 0
+
+    def acquire(self, command_log=None):
+        if self._idle:
+            p = self._idle.pop()
+        else:
+            kwargs = dict(self._kwargs)
+            if self._valgrind_log:
+                kwargs['valgrind_log'] = self._valgrind_log % self.spawned
+            p = Wet1Proxy(**kwargs)
+            self.spawned += 1
+        p.set_command_log(command_log)
+        return p
+
+    def _reset(self, p):
+        if p._proc.poll() is not None:
+            return False
+        if p.Quit().strip() != 'Quit done.':
+            return False
+        p.set_command_log(None)
+        if p.receive()[0]:
+            return False
+        return p.Comment(self.MARKER).strip() == '#' + self.MARKER
+
+    def release(self, p):
+        if self._reset(p):
+            self._idle.append(p)
+        else:
+            self._stop(p)
+
+    @staticmethod
+    def _stop(p, grace=10):
+        """End p with an empty line, giving it (and valgrind's leak report)
+        grace seconds before it is killed."""
+        p.set_command_log(None)
+        p.send(['', ''])
+        deadline = time.time() + grace
+        while p._proc.poll() is None and time.time() < deadline:
+            time.sleep(IDLE_POLL)
+        if p._proc.poll() is None:
+            p._proc.kill()
+            p._proc.wait()
+
+    def close(self):
+        while self._idle:
+            self._stop(self._idle.pop())
+
+
+class LatencyHistogram(object):
+    """Log-linear histogram of durations with ~1% resolution, HdrHistogram
+    style: each power of two is split into SUB_BUCKETS linear buckets."""
+
+    SUB_BUCKETS = 64
+
+    def __init__(self):
+        self.counts = collections.defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if seconds > 0:
+            m, e = math.frexp(seconds)
+            self.counts[e * self.SUB_BUCKETS +
+                        int((m - 0.5) * 2 * self.SUB_BUCKETS)] += 1
+        else:
+            self.counts[None] += 1
+
+    def _bucket_value(self, key):
+        if key is None:
+            return 0.0
+        e, sub = divmod(key, self.SUB_BUCKETS)
+        return min(math.ldexp(0.5 + (sub + 1) / (2.0 * self.SUB_BUCKETS), e),
+                   self.max)
+
+    def percentile(self, q):
+        rank, seen = q * self.count, 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= rank:
+                return self._bucket_value(key)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class LatencyStats(object):
+    """Per-op latency histograms of the simulator and the exec."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.histograms = {}
+        self.logging = 0.0
+
+    def record(self, side, name, seconds):
+        try:
+            h = self.histograms[side, name]
+        except KeyError:
+            h = self.histograms[side, name] = LatencyHistogram()
+        h.record(seconds)
+
+    def report(self):
+        wall = time.time() - self.start
+        spent = {'simulator': 0.0, 'exec': 0.0, 'logging': self.logging}
+        ops = {}
+        for (side, name), h in self.histograms.items():
+            spent[side] += h.total
+            ops.setdefault(name, {})[side] = h.summary()
+        spent['other'] = max(wall - sum(spent.values()), 0.0)
+        return {
+            'wall_seconds': wall,
+            'seconds': spent,
+            'share': dict((k, v / wall if wall else 0.0)
+                          for k, v in spent.items()),
+            'ops': ops,
+        }
 
 
 class SimulatedWet1ProxyException(RuntimeError):
@@ -268,63 +1053,144 @@ class SimulatedWet1ProxyException(RuntimeError):
 
 
 class SimulatedWet1Proxy:
-    def __init__(self, proxy_output=None, sim_output=None, *args, **kwargs):
+    def __init__(self, proxy_output=None, sim_output=None, memory_log=None,
+                 memory_every=1, latency_log=None, proxy=None, *args,
+                 **kwargs):
         self.proxy_stdout, self.sim_stdout = None, None
         if proxy_output:
-            self.proxy_stdout = open(proxy_output, 'w')
+            self.proxy_stdout = ArtifactLog(proxy_output)
         if sim_output:
-            self.sim_stdout = open(sim_output, 'w')
-        self._p = Wet1Proxy(*args, **kwargs)
+            self.sim_stdout = ArtifactLog(sim_output)
+        self.memory_log = None
+        if memory_log:
+            self.memory_log = open(memory_log, 'w')
+            self.memory_log.write('# command employees firms rss_kb hwm_kb\n')
+        self._memory_every = memory_every
+        self._commands = 0
+        self.failed = False
+        self.latency_log = latency_log
+        self._latency = LatencyStats() if latency_log else None
+        self._p = proxy or Wet1Proxy(*args, **kwargs)
         self._s = Wet1Sim(*args, **kwargs)
 
+    def _sample_memory(self):
+        # In batch mode the exec may already be up to a window ahead of the
+        # simulator when it is sampled.
+        memory = self._p.memory()
+        if memory:
+            self.memory_log.write('%d %d %d %d %d\n' % (
+                (self._commands, self._s.live_employees(),
+                 self._s.num_firms()) + memory))
+
     def _assertEqual(self, a, b):
         if (a != b):
+            self.failed = True
             raise SimulatedWet1ProxyException(a, b)
 
-    def _runOnBoth(self, func):
-        sim_output = func(self._s).strip()
-        proxy_output = func(self._p).strip()
+    def _record(self, sim_output, proxy_output):
+        if self._latency:
+            start = time.time()
+        self._commands += 1
+        if self.memory_log and self._commands % self._memory_every == 0:
+            self._sample_memory()
         if self.sim_stdout:
             self.sim_stdout.write(sim_output + '\n')
         if self.proxy_stdout:
             self.proxy_stdout.write(proxy_output + '\n')
+        if self._latency:
+            self._latency.logging += time.time() - start
         self._assertEqual(proxy_output, sim_output)
 
+    def _runOnBoth(self, name, *args):
+        if not self._latency:
+            sim_output = getattr(self._s, name)(*args).strip()
+            proxy_output = getattr(self._p, name)(*args).strip()
+            self._record(sim_output, proxy_output)
+            return
+        t0 = time.time()
+        sim_output = getattr(self._s, name)(*args).strip()
+        t1 = time.time()
+        proxy_output = getattr(self._p, name)(*args).strip()
+        t2 = time.time()
+        self._latency.record('simulator', name, t1 - t0)
+        self._latency.record('exec', name, t2 - t1)
+        self._record(sim_output, proxy_output)
+
+    def run_batch(self, commands, window=256):
+        """Run (name, args) commands, pipelining them to the process."""
+        commands, queued = itertools.tee(commands)
+        proxy_outputs = self._p.query_batch(
+            (format_command(name, *args) for name, args in queued), window)
+        for name, args in commands:
+            # In batch mode the exec side is the wait for each response, the
+            # first one of a window including the write.
+            t0 = time.time()
+            proxy_output = next(proxy_outputs).strip()
+            t1 = time.time()
+            sim_output = getattr(self._s, name)(*args).strip()
+            if self._latency:
+                t2 = time.time()
+                self._latency.record('exec', name, t1 - t0)
+                self._latency.record('simulator', name, t2 - t1)
+            self._record(sim_output, proxy_output)
+        # Reads the SYNC echo that ends the last window.
+        for _ in proxy_outputs:
+            pass
+
+    def close(self, keep=None):
+        """Close the output and command logs, writing the latency report if
+        enabled.
+
+        Unless keep is given, the logs are kept if the outputs diverged or
+        WET1_LOG_FAILURES_ONLY is not set.
+        """
+        if keep is None:
+            keep = self.failed or not LOG_FAILURES_ONLY
+        if self._latency:
+            with open(self.latency_log, 'w') as f:
+                json.dump(self._latency.report(), f, indent=2, sort_keys=True)
+        for f in (self.proxy_stdout, self.sim_stdout):
+            if f:
+                f.close(keep)
+        if self.memory_log:
+            self.memory_log.close()
+        self._p.set_command_log(None, keep)
+
     def Init(self, k):
-        self._runOnBoth(lambda x: x.Init(k))
+        self._runOnBoth('Init', k)
 
     def AddJobSearcher(self, id, salary):
-        self._runOnBoth(lambda x: x.AddJobSearcher(id, salary))
+        self._runOnBoth('AddJobSearcher', id, salary)
 
     def RemoveJobSearcher(self, id):
-        self._runOnBoth(lambda x: x.RemoveJobSearcher(id))
+        self._runOnBoth('RemoveJobSearcher', id)
 
     def Hire(self, cid, id):
-        self._runOnBoth(lambda x: x.Hire(cid, id))
+        self._runOnBoth('Hire', cid, id)
 
     def HireBySalary(self, cid, thd):
-        self._runOnBoth(lambda x: x.HireBySalary(cid, thd))
+        self._runOnBoth('HireBySalary', cid, thd)
 
     def Bonus(self, cid, id, bonus):
-        self._runOnBoth(lambda x: x.Bonus(cid, id, bonus))
+        self._runOnBoth('Bonus', cid, id, bonus)
 
     def Fire(self, cid, id):
-        self._runOnBoth(lambda x: x.Fire(cid, id))
+        self._runOnBoth('Fire', cid, id)
 
     def GetNumEmployed(self, cid):
-        self._runOnBoth(lambda x: x.GetNumEmployed(cid))
+        self._runOnBoth('GetNumEmployed', cid)
 
     def HighestPaid(self, cid):
-        self._runOnBoth(lambda x: x.HighestPaid(cid))
+        self._runOnBoth('HighestPaid', cid)
 
     def CutBacks(self, cid, thd, cut):
-        self._runOnBoth(lambda x: x.CutBacks(cid, thd, cut))
+        self._runOnBoth('CutBacks', cid, thd, cut)
 
     def Quit(self):
-        self._runOnBoth(lambda x: x.Quit())
+        self._runOnBoth('Quit')
 
     def Comment(self, c):
-        self._runOnBoth(lambda x: x.Comment(c))
+        self._runOnBoth('Comment', c)
 
 if __name__ == '__main__':
     pass
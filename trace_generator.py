@@ -0,0 +1,302 @@
+#!/usr/bin/python
+import argparse
+import bisect
+import random
+import sys
+import simulator as sim
+
+OPS = ['AddJobSearcher', 'RemoveJobSearcher', 'Hire', 'HireBySalary',
+       'Bonus', 'Fire', 'GetNumEmployed', 'HighestPaid', 'CutBacks']
+
+# Op mix weights of the named phases.
+PHASES = {
+    'mix': dict((op, 1) for op in OPS),
+    'add': {'AddJobSearcher': 1},
+    'remove': {'RemoveJobSearcher': 1},
+    'hire': {'Hire': 1, 'HireBySalary': 1},
+    'fire': {'Fire': 1},
+    'bonus': {'Bonus': 1},
+    'query': {'GetNumEmployed': 1, 'HighestPaid': 1},
+    'cutbacks': {'CutBacks': 3, 'HighestPaid': 1},
+}
+
+
+class TraceGenerator(object):
+    """Seeded, lazy producer of wet1 command streams.
+
+    Arguments are drawn independently of each other, so memory use does not
+    grow with the trace length.
+    """
+
+    def __init__(self, seed=None, firms=10, ids=(0, 1000), salaries=(0, 1000),
+                 invalid=0.0):
+        self._rand = random.Random(seed)
+        self.firms = firms
+        self.ids = ids
+        self.salaries = salaries
+        self.invalid = invalid
+
+    def _cid(self):
+        if self._rand.random() < self.invalid:
+            return self._rand.choice([-1, self.firms])
+        return self._rand.randrange(self.firms)
+
+    def _id(self):
+        if self._rand.random() < self.invalid:
+            return -1
+        return self._rand.randint(*self.ids)
+
+    def _salary(self):
+        if self._rand.random() < self.invalid:
+            return -1
+        return self._rand.randint(*self.salaries)
+
+    def _args(self, op):
+        if op == 'AddJobSearcher':
+            return self._id(), self._salary()
+        elif op == 'RemoveJobSearcher':
+            return self._id(),
+        elif op in ('Hire', 'Fire'):
+            return self._cid(), self._id()
+        elif op == 'HireBySalary':
+            return self._cid(), self._salary()
+        elif op == 'Bonus':
+            return self._cid(), self._id(), self._salary()
+        elif op in ('GetNumEmployed', 'HighestPaid'):
+            return self._cid(),
+        elif op == 'CutBacks':
+            thd = self._salary()
+            return self._cid(), thd, self._rand.randint(0, max(thd, 0))
+        raise ValueError('Unknown op %s' % op)
+
+    def phase(self, count, weights):
+        ops = sorted(weights)
+        cumulative, total = [], 0
+        for op in ops:
+            total += weights[op]
+            cumulative.append(total)
+        for _ in xrange(count):
+            op = ops[bisect.bisect_right(cumulative,
+                                         self._rand.random() * total)]
+            yield op, self._args(op)
+
+    def generate(self, phases, quit=True):
+        """Yield (name, args) for Init, then each (count, weights) phase."""
+        yield 'Init', (self.firms,)
+        for count, weights in phases:
+            for command in self.phase(count, weights):
+                yield command
+        if quit:
+            yield 'Quit', ()
+
+
+class _IdPool(object):
+    """Ids with O(1) add, remove and random choice."""
+
+    def __init__(self):
+        self._ids = []
+        self._pos = {}
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, id):
+        self._pos[id] = len(self._ids)
+        self._ids.append(id)
+
+    def remove(self, id):
+        i = self._pos.pop(id)
+        last = self._ids.pop()
+        if last != id:
+            self._ids[i] = last
+            self._pos[last] = i
+
+    def choice(self, rand):
+        return self._ids[rand.randrange(len(self._ids))]
+
+
+class StatefulTraceGenerator(TraceGenerator):
+    """TraceGenerator that runs its own commands on a Wet1Sim and draws
+    arguments from the live state: ids of existing job searchers and
+    employees, and thresholds taken from actual salaries.
+
+    With probability invalid an argument is drawn blindly as in
+    TraceGenerator instead, covering the Invalid_input and Failure paths.
+    focus is the probability of picking firm 0, to grow one firm far beyond
+    the others.
+    """
+
+    def __init__(self, seed=None, firms=10, ids=(0, 1000), salaries=(0, 1000),
+                 invalid=0.0, focus=None):
+        TraceGenerator.__init__(self, seed, firms, ids, salaries, invalid)
+        self.focus = focus
+        self.sim = sim.Wet1Sim()
+        self._pools = {}
+        self._firm_index = {}
+
+    def _blind(self):
+        return self._rand.random() < self.invalid
+
+    def _firm(self):
+        if self.focus is not None and self._rand.random() < self.focus:
+            return 0
+        return self._rand.randrange(self.firms)
+
+    def _member(self, location):
+        pool = self._pools[location]
+        if pool:
+            return pool.choice(self._rand)
+        return TraceGenerator._id(self)
+
+    def _salary_in(self, location):
+        if not self._pools[location]:
+            return TraceGenerator._salary(self)
+        id = self._member(location)
+        e = self.sim.ged.get(id)
+        if location < 0:
+            return e.salary
+        return self.sim.firms[location].salary_of(e)
+
+    def _args(self, op):
+        if self._blind() or not self._pools:
+            return TraceGenerator._args(self, op)
+        if op == 'AddJobSearcher':
+            id = TraceGenerator._id(self)
+            for _ in xrange(3):
+                if id not in self.sim.ged:
+                    break
+                id = TraceGenerator._id(self)
+            return id, TraceGenerator._salary(self)
+        elif op == 'RemoveJobSearcher':
+            return self._member(-1),
+        elif op == 'Hire':
+            return self._firm(), self._member(-1)
+        elif op == 'HireBySalary':
+            return self._firm(), self._salary_in(-1)
+        elif op in ('Bonus', 'Fire'):
+            cid = self._firm()
+            id = self._member(cid)
+            if op == 'Fire':
+                return cid, id
+            return cid, id, self._rand.randint(0, self.salaries[1])
+        elif op in ('GetNumEmployed', 'HighestPaid'):
+            return self._firm(),
+        elif op == 'CutBacks':
+            cid = self._firm()
+            thd = self._salary_in(cid)
+            return cid, thd, self._rand.randint(0, max(thd, 0))
+        raise ValueError('Unknown op %s' % op)
+
+    def _move(self, id, old):
+        """Refile id after a command that may have moved it from old."""
+        new = None
+        if id in self.sim.ged:
+            new = self._firm_index[self.sim.ged.firm_of(id)]
+        if new != old:
+            if old is not None:
+                self._pools[old].remove(id)
+            if new is not None:
+                self._pools[new].add(id)
+
+    def _run(self, name, args):
+        if name == 'Init' and not self._pools:
+            self.sim.Init(*args)
+            self._firm_index = dict((f, i)
+                                    for i, f in enumerate(self.sim.firms))
+            self._firm_index[self.sim.recr] = -1
+            self._pools = dict((i, _IdPool())
+                               for i in xrange(-1, len(self.sim.firms)))
+            return
+        if name == 'Quit':
+            self.sim.Quit()
+            self._pools = {}
+            return
+        if name == 'Comment' or not self._pools:
+            return
+        moved = []
+        if name == 'HireBySalary':
+            e = self.sim.recr.find_by_salary(args[1])
+            if e is not None:
+                moved.append(e.id)
+        elif name in ('AddJobSearcher', 'RemoveJobSearcher'):
+            moved.append(args[0])
+        elif name in ('Hire', 'Fire'):
+            moved.append(args[1])
+        old = [self._firm_index[self.sim.ged.firm_of(id)]
+               if id in self.sim.ged else None for id in moved]
+        getattr(self.sim, name)(*args)
+        for id, location in zip(moved, old):
+            self._move(id, location)
+
+    def generate(self, phases, quit=True):
+        for name, args in TraceGenerator.generate(self, phases, quit):
+            self._run(name, args)
+            yield name, args
+
+
+def write_trace(commands, f):
+    for name, args in commands:
+        f.write(sim.format_command(name, *args) + '\n')
+
+
+def parse_range(text):
+    lo, hi = text.split(':')
+    return int(lo), int(hi)
+
+
+def parse_phase(text):
+    """'add:1000' or '1000:Hire=2,Fire=1' -> (count, weights)."""
+    head, tail = text.split(':', 1)
+    if head in PHASES:
+        return int(tail), PHASES[head]
+    weights = {}
+    for item in tail.split(','):
+        op, weight = item.split('=')
+        if op not in OPS:
+            raise argparse.ArgumentTypeError('unknown op %s' % op)
+        weights[op] = float(weight)
+    return int(head), weights
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Generate a wet1 command trace.')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-k', '--firms', type=int, default=10)
+    parser.add_argument('--ids', type=parse_range, default=(0, 1000),
+                        metavar='LO:HI')
+    parser.add_argument('--salaries', type=parse_range, default=(0, 1000),
+                        metavar='LO:HI')
+    parser.add_argument('--invalid', type=float, default=0.0,
+                        help='probability of an out-of-range argument')
+    parser.add_argument('-p', '--phase', type=parse_phase, action='append',
+                        metavar='NAME:COUNT|COUNT:OP=W,...',
+                        help='phase to generate, in order; NAME is one of '
+                             '%s (default: mix:100000)' %
+                             ', '.join(sorted(PHASES)))
+    parser.add_argument('--stateful', action='store_true',
+                        help='draw ids and thresholds from the simulated '
+                             'state, so most commands succeed')
+    parser.add_argument('--focus', type=float, metavar='P',
+                        help='with --stateful, probability of picking firm 0')
+    parser.add_argument('--no-quit', action='store_true')
+    parser.add_argument('-o', '--output', default='-')
+    args = parser.parse_args()
+
+    if args.stateful:
+        gen = StatefulTraceGenerator(args.seed, args.firms, args.ids,
+                                     args.salaries, args.invalid, args.focus)
+    else:
+        gen = TraceGenerator(args.seed, args.firms, args.ids, args.salaries,
+                             args.invalid)
+    commands = gen.generate(args.phase or [parse_phase('mix:100000')],
+                            quit=not args.no_quit)
+    if args.output == '-':
+        write_trace(commands, sys.stdout)
+    else:
+        with open(args.output, 'w') as f:
+            write_trace(commands, f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+import argparse
+import datetime
+import glob
+import json
+import multiprocessing
+import os
+import random
+import re
+import subprocess
+import sys
+import parallel_runner
+import simulator as sim
+
+SUMMARY = re.compile(r'ERROR SUMMARY: (\d+) errors')
+LEAK = re.compile(r'(definitely|indirectly|possibly) lost: ([\d,]+) bytes')
+
+
+def valgrind_log_path(command_log):
+    head, tail = os.path.split(command_log)
+    for suffix in ('.gz', '.zst'):
+        if tail.endswith(suffix):
+            tail = tail[:-len(suffix)]
+    if '-commands-' in tail:
+        return os.path.join(head, tail.replace('-commands-', '-valgrind-'))
+    return command_log + '.valgrind'
+
+
+def parse_valgrind_log(path):
+    """Error count and lost bytes of a valgrind log."""
+    result = {'errors': 0, 'definitely': 0, 'indirectly': 0, 'possibly': 0}
+    with open(path) as f:
+        for line in f:
+            m = SUMMARY.search(line)
+            if m:
+                result['errors'] = int(m.group(1))
+            m = LEAK.search(line)
+            if m:
+                result[m.group(1)] = int(m.group(2).replace(',', ''))
+    return result
+
+
+def replay(job):
+    """Feed a command log to the exec under valgrind, without any
+    per-command timeout; returns (command log, exit code, log summary)."""
+    command_log, valgrind_args = job
+    log = valgrind_log_path(command_log)
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(
+            ['valgrind'] + valgrind_args + ['--log-file=%s' % log,
+                                            sim.PATH_TO_EXEC],
+            stdin=subprocess.PIPE, stdout=devnull)
+        try:
+            last = None
+            for line in sim.read_log(command_log):
+                proc.stdin.write(line)
+                if line.strip() and not line.startswith('#'):
+                    last = line
+            # Logs of warm execs end before the Quit their test ends with;
+            # without it every structure would be reported as leaked.
+            if last is None or sim.command_name(last.strip()) != 'Quit':
+                proc.stdin.write('Quit\n')
+            # An empty line ends the exec, as at the end of a test.
+            proc.stdin.write('\n\n')
+            proc.stdin.close()
+        except IOError:
+            pass
+        code = proc.wait()
+    return command_log, code, parse_valgrind_log(log)
+
+
+def run_native(suites, jobs):
+    """Run the suites without valgrind; returns their command logs."""
+    before = set(glob.glob(os.path.join(os.getcwd(), 'test-output', '*', '*')))
+    cmd = [sys.executable, os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), 'parallel_runner.py'), '-j', str(jobs)]
+    cmd += suites
+    env = dict(os.environ)
+    # Replays need complete logs of every test, ending with Quit.
+    for name in ('WET1_VALGRIND', 'WET1_LOG_FAILURES_ONLY', 'WET1_LOG_TAIL',
+                 'WET1_WARM'):
+        env.pop(name, None)
+    subprocess.call(cmd, env=env)
+    after = set(glob.glob(os.path.join(os.getcwd(), 'test-output', '*', '*')))
+    logs = []
+    for path in sorted(after - before):
+        logs.extend(glob.glob(os.path.join(path, '*-commands-*')))
+    return logs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check command logs for leaks and memory errors by '
+                    'replaying them under valgrind over a pool of processes.')
+    parser.add_argument('commands', nargs='*', help='command logs')
+    parser.add_argument('--native', nargs='*', metavar='suite',
+                        help='first run these suites (all if none given) '
+                             'natively and replay their command logs')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--sample', type=float, default=1.0,
+                        help='fraction of the logs to replay')
+    parser.add_argument('-s', '--seed', type=int, default=0,
+                        help='seed of the sample')
+    parser.add_argument('--valgrind-args', default='--leak-check=full',
+                        help='(default: %(default)s)')
+    parser.add_argument('-o', '--output', help='JSON report')
+    args = parser.parse_args()
+
+    logs = list(args.commands)
+    if args.native is not None:
+        suites = args.native or sorted(parallel_runner.SUITES)
+        for module_name in suites:
+            if module_name not in parallel_runner.SUITES:
+                parser.error('unknown suite %s' % module_name)
+        logs.extend(run_native(suites, args.jobs))
+    if args.sample < 1:
+        rand = random.Random(args.seed)
+        logs = [log for log in logs if rand.random() < args.sample]
+    # Longest logs first, so no long replay starts last.
+    logs.sort(key=os.path.getsize, reverse=True)
+
+    jobs = [(log, args.valgrind_args.split()) for log in logs]
+    pool = multiprocessing.Pool(args.jobs)
+    results = sorted(pool.imap_unordered(replay, jobs))
+    pool.close()
+    pool.join()
+
+    bad = 0
+    report = {}
+    for command_log, code, summary in results:
+        leaked = (summary['definitely'] + summary['indirectly'] +
+                  summary['possibly'])
+        ok = not summary['errors'] and not leaked
+        bad += not ok
+        report[command_log] = dict(summary, exit_code=code, passed=ok)
+        sys.stdout.write('%s ... %s (%d errors, %d bytes lost)\n' % (
+            command_log, 'ok' if ok else 'FAIL', summary['errors'], leaked))
+    sys.stdout.write('\n%d of %d logs with leaks or errors\n' % (bad,
+                                                                 len(results)))
+    output = args.output
+    if not output:
+        output = os.path.join(os.getcwd(), 'test-output', 'valgrind-%s.json' %
+                              datetime.datetime.now().strftime('%Y%m%d%H%M%S'))
+        if not os.path.isdir(os.path.dirname(output)):
+            os.makedirs(os.path.dirname(output))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return 1 if bad else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())